@@ -1,11 +1,17 @@
 import logging
 import asyncpg
 import os
+import re
 import asyncio
+import functools
+import threading
+import time
+from collections import OrderedDict
 from aiohttp import web 
 from aiogram import Bot, Dispatcher, types, F, html
 from aiogram.enums import ParseMode
 from aiogram.filters import Command, CommandObject, StateFilter
+from aiogram.filters.callback_data import CallbackData
 from aiogram.fsm.state import State, StatesGroup
 from aiogram.fsm.context import FSMContext
 from aiogram.fsm.storage.memory import MemoryStorage
@@ -13,7 +19,7 @@ from dotenv import load_dotenv
 from aiogram.client.default import DefaultBotProperties
 from aiogram.types import (
     InlineKeyboardButton, InlineKeyboardMarkup, ReplyKeyboardMarkup,
-    KeyboardButton, ReplyKeyboardRemove, ForceReply, InputMediaPhoto
+    KeyboardButton, ReplyKeyboardRemove, ForceReply
 )
 from aiogram.utils.keyboard import InlineKeyboardBuilder
 from aiogram.webhook.aiohttp_server import SimpleRequestHandler, setup_application 
@@ -21,6 +27,11 @@ from datetime import datetime, timedelta
 from aiogram.exceptions import TelegramBadRequest, TelegramForbiddenError, TelegramRetryAfter
 from typing import Optional, Tuple, Dict, Any, List
 from aiogram.dispatcher.middlewares.base import BaseMiddleware
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware
+from aiogram.methods import (
+    SendMessage, SendPhoto, SendSticker, SendAnimation, SendVideo, SendDocument, SendMediaGroup,
+    CopyMessage, ForwardMessage, EditMessageText, EditMessageCaption, EditMessageMedia, EditMessageReplyMarkup
+)
 
 
 
@@ -44,6 +55,8 @@ CHANNEL_ID = os.getenv("CHANNEL_ID")
 PAGE_SIZE = int(os.getenv("PAGE_SIZE", "15"))  # Number of items per page for pagination
 
 DATABASE_URL = os.getenv("DATABASE_URL")
+# Optional Redis URL for FSM storage, so conversation state survives restarts and is shared between bot workers
+REDIS_URL = os.getenv("REDIS_URL")
 # PORT  dummy HTTP server, Render sets this for Web Services
 HTTP_PORT_STR = os.getenv("PORT")
 
@@ -67,11 +80,42 @@ bot = Bot(
     token=BOT_TOKEN,
     default=DefaultBotProperties(parse_mode=ParseMode.HTML)
 )
-dp = Dispatcher(storage=MemoryStorage())
+def create_fsm_storage():
+    """Uses Redis for FSM state when REDIS_URL is set, otherwise keeps it in process memory."""
+    if REDIS_URL:
+        # Imported lazily: RedisStorage needs the optional 'redis' package
+        from aiogram.fsm.storage.redis import RedisStorage
+        from aiogram.fsm.storage.base import DefaultKeyBuilder
+        logging.info("Using Redis FSM storage.")
+        return RedisStorage.from_url(REDIS_URL, key_builder=DefaultKeyBuilder(with_bot_id=True))
+    return MemoryStorage()
+
+dp = Dispatcher(storage=create_fsm_storage())
 
 # Bot info
 bot_info = None
 
+async def get_bot_info() -> types.User:
+    """Returns the bot's own User, calling getMe only the first time."""
+    global bot_info
+    if bot_info is None:
+        bot_info = await bot.get_me()
+    return bot_info
+
+async def confession_view_link(conf_id: int) -> str:
+    """Deep link that opens a confession in the bot."""
+    return f"https://t.me/{(await get_bot_info()).username}?start=view_{conf_id}"
+
+# --- Callback data prefixes for single-id buttons; handlers strip the prefix by slicing instead of splitting ---
+REQ_DEL_CONF_PREFIX = "req_del_conf_"
+CONFIRM_DEL_CONF_PREFIX = "confirm_del_conf_"
+BROWSE_PREFIX = "browse_"
+ADD_COMMENT_PREFIX = "add_"
+REPLY_PREFIX = "reply_"
+REPORT_CONFIRM_PREFIX = "report_confirm_"
+REPORT_EXECUTE_PREFIX = "report_execute_"
+REQ_CONTACT_PREFIX = "req_contact_"
+
 # --- FSM States ---
 class ConfessionForm(StatesGroup):
     selecting_categories = State()
@@ -87,11 +131,46 @@ class ContactAdminForm(StatesGroup):
 class AdminActions(StatesGroup):
     waiting_for_rejection_reason = State()
 
+# --- Callback data factories ---
+REACTION_TYPES = ('like', 'dislike')
+
+class ReactionCallback(CallbackData, prefix="react", sep="_"):
+    """Packs to react_<type>_<comment_id>, the same format as existing buttons in users' chats."""
+    type: str
+    comment_id: int
+
 # --- Database ---
 db = None
+# Pool bounds can be overridden per deployment (e.g. to fit a hosted database's connection limit)
+DB_POOL_MIN_SIZE = int(os.getenv("DB_POOL_MIN_SIZE", "10"))
+DB_POOL_MAX_SIZE = int(os.getenv("DB_POOL_MAX_SIZE", "50"))
+DB_MAX_INACTIVE_CONNECTION_LIFETIME = 300  # Seconds before an idle pooled connection is closed
+DB_COMMAND_TIMEOUT = 10  # Seconds
+DB_STATEMENT_CACHE_SIZE = 1024  # Prepared statements cached per connection
+DB_APPLICATION_NAME = "confession_bot"
+SCHEMA_VERSION = 1  # Bump whenever apply_schema() changes so existing databases pick up the new DDL
+SCHEMA_LOCK_KEY = 7_460_531_201  # pg_advisory_xact_lock key serializing schema setup across bot instances
+
 async def create_db_pool():
     try:
-        pool = await asyncpg.create_pool(DATABASE_URL)
+        pool = await asyncpg.create_pool(
+            DATABASE_URL,
+            min_size=DB_POOL_MIN_SIZE,
+            max_size=DB_POOL_MAX_SIZE,
+            max_inactive_connection_lifetime=DB_MAX_INACTIVE_CONNECTION_LIFETIME,
+            command_timeout=DB_COMMAND_TIMEOUT,
+            statement_cache_size=DB_STATEMENT_CACHE_SIZE,
+            server_settings={
+                # Our queries are small OLTP lookups; JIT compilation only adds latency to them
+                'jit': 'off',
+                # Identifies the bot's sessions in pg_stat_activity and server logs
+                'application_name': DB_APPLICATION_NAME,
+                # Keepalive probes keep idle pooled connections alive through NATs/proxies and expose dead ones early
+                'tcp_keepalives_idle': '60',
+                'tcp_keepalives_interval': '20',
+                'tcp_keepalives_count': '3',
+            }
+        )
         async with pool.acquire() as conn:
             await conn.execute("SELECT 1")
         logging.info("Database pool created successfully.")
@@ -101,120 +180,215 @@ async def create_db_pool():
         raise
 
 async def setup():
-    global db, bot_info
-    db = await create_db_pool()
-    bot_info = await bot.get_me()
-    logging.info(f"Bot started: @{bot_info.username}")
+    global db, tg_send_semaphore, tg_send_limiter
+    tg_send_semaphore = asyncio.Semaphore(TG_MAX_CONCURRENT_SENDS)
+    tg_send_limiter = TokenBucket(TG_SENDS_PER_SECOND, TG_SENDS_PER_SECOND)
+    bot.session.middleware(TelegramRateLimitMiddleware())
+    # Pool creation and the getMe round trip are independent, so run them concurrently
+    db, me = await asyncio.gather(create_db_pool(), get_bot_info())
+    logging.info(f"Bot started: @{me.username}")
 
     async with db.acquire() as conn:
-        # --- Confessions Table Schema ---
-        await conn.execute("""
-            CREATE TABLE IF NOT EXISTS confessions (
-                id SERIAL PRIMARY KEY,
-                text TEXT NOT NULL,
-                user_id BIGINT NOT NULL,
-                status VARCHAR(10) DEFAULT 'pending',
-                message_id BIGINT,
-                photo_file_id TEXT NULL,
-                created_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP,
-                rejection_reason TEXT NULL,
-                categories TEXT[] NULL
-            );
-        """)
-        logging.info("Checked/Created 'confessions' table.")
-        
-        # Ensure photo_file_id column exists (for backward compatibility)
-        await conn.execute("""
-            DO $$ 
-            BEGIN
-                IF NOT EXISTS (SELECT 1 FROM information_schema.columns 
-                              WHERE table_name='confessions' AND column_name='photo_file_id') THEN
-                    ALTER TABLE confessions ADD COLUMN photo_file_id TEXT NULL;
-                END IF;
-            END $$;
-        """)
-        logging.info("Ensured photo_file_id column exists.")
-        
-        # ... rest of your existing setup code ...
-
-        # --- Reactions Table ---
-        await conn.execute("""
-             CREATE TABLE IF NOT EXISTS reactions ( id SERIAL PRIMARY KEY, comment_id INTEGER REFERENCES comments(id) ON DELETE CASCADE,
-                 user_id BIGINT NOT NULL, reaction_type VARCHAR(10) NOT NULL, created_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP,
-                 UNIQUE(comment_id, user_id) );
-        """)
-        logging.info("Checked/Created 'reactions' table.")
-
-        # --- Rebuilt Contact Requests Table ---
-        await conn.execute("""
-            CREATE TABLE IF NOT EXISTS contact_requests (
-                id SERIAL PRIMARY KEY,
-                confession_id INTEGER NOT NULL REFERENCES confessions(id) ON DELETE CASCADE,
-                comment_id INTEGER NOT NULL REFERENCES comments(id) ON DELETE CASCADE,
-                requester_user_id BIGINT NOT NULL,
-                requested_user_id BIGINT NOT NULL,
-                status VARCHAR(20) NOT NULL DEFAULT 'pending', -- pending, approved, denied, approved_no_username, failed_to_notify
-                created_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP,
-                updated_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP,
-                UNIQUE (comment_id, requester_user_id)
-            );
-            COMMENT ON TABLE contact_requests IS 'Stores requests from confession authors to contact commenters (V2).';
-        """)
-        logging.info("Checked/Created 'contact_requests' table (V2).")
-
-        # --- User Points Table ---
-        await conn.execute("""
-            CREATE TABLE IF NOT EXISTS user_points (
-                user_id BIGINT PRIMARY KEY,
-                points INTEGER NOT NULL DEFAULT 0
-            );
-            CREATE INDEX IF NOT EXISTS idx_user_points_user_id ON user_points(user_id);
-        """)
-        logging.info("Checked/Created 'user_points' table and index.")
-
-        # --- Reports Table ---
-        await conn.execute("""
-            CREATE TABLE IF NOT EXISTS reports (
-                id SERIAL PRIMARY KEY,
-                comment_id INTEGER NOT NULL REFERENCES comments(id) ON DELETE CASCADE,
-                reporter_user_id BIGINT NOT NULL,
-                reported_user_id BIGINT NOT NULL,
-                status VARCHAR(20) NOT NULL DEFAULT 'pending',
-                created_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP,
-                UNIQUE (comment_id, reporter_user_id)
-            );
-        """)
-        logging.info("Checked/Created 'reports' table.")
-
-        # --- Deletion Requests Table ---
-        await conn.execute("""
-            CREATE TABLE IF NOT EXISTS deletion_requests (
-                id SERIAL PRIMARY KEY,
-                confession_id INTEGER NOT NULL REFERENCES confessions(id) ON DELETE CASCADE,
-                user_id BIGINT NOT NULL,
-                status VARCHAR(20) NOT NULL DEFAULT 'pending', -- pending, approved, rejected
-                created_at TIMESTAMP WITH TIME ZONE,
-                reviewed_at TIMESTAMP WITH TIME ZONE,
-                UNIQUE (confession_id, user_id) -- User can only request deletion for their confession once
-            );
-            COMMENT ON TABLE deletion_requests IS 'Stores user requests to delete their own confessions.';
-        """)
-        logging.info("Checked/Created 'deletion_requests' table.")
-
-        # --- NEW: User Status Table (for rules acceptance and blocking) ---
-        await conn.execute("""
-            CREATE TABLE IF NOT EXISTS user_status (
-                user_id BIGINT PRIMARY KEY,
-                has_accepted_rules BOOLEAN NOT NULL DEFAULT FALSE,
-                is_blocked BOOLEAN NOT NULL DEFAULT FALSE,
-                blocked_until TIMESTAMP WITH TIME ZONE NULL,
-                block_reason TEXT NULL
-            );
-        """)
-        logging.info("Checked/Created 'user_status' table.")
-
-
-        logging.info("Database tables setup complete.")
+        # All schema changes run in one transaction so a failed startup never leaves a half-migrated database
+        async with conn.transaction():
+            # Instances starting together queue on this lock; the version is read only once it is held,
+            # so later instances see the schema the first one applied and skip the DDL
+            await conn.execute("SELECT pg_advisory_xact_lock($1)", SCHEMA_LOCK_KEY)
+            # schema_version records the last schema applied, so ordinary restarts skip re-running all the DDL
+            await conn.execute("CREATE TABLE IF NOT EXISTS schema_version (version INTEGER PRIMARY KEY, applied_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP)")
+            applied_version = await conn.fetchval("SELECT MAX(version) FROM schema_version")
+            if applied_version is not None and applied_version >= SCHEMA_VERSION:
+                logging.info(f"Database schema is at version {applied_version}; skipping setup.")
+                return
+            await apply_schema(conn)
+            await conn.execute("INSERT INTO schema_version (version) VALUES ($1) ON CONFLICT DO NOTHING", SCHEMA_VERSION)
+        logging.info(f"Database tables setup complete (schema version {SCHEMA_VERSION}).")
+
+async def apply_schema(conn):
+    """Creates or migrates every table, trigger and index. Every statement is idempotent."""
+    # --- Confessions Table Schema ---
+    await conn.execute("""
+        CREATE TABLE IF NOT EXISTS confessions (
+            id SERIAL PRIMARY KEY,
+            text TEXT NOT NULL,
+            user_id BIGINT NOT NULL,
+            status VARCHAR(10) DEFAULT 'pending',
+            message_id BIGINT,
+            photo_file_id TEXT NULL,
+            created_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP,
+            rejection_reason TEXT NULL,
+            categories TEXT[] NULL
+        );
+    """)
+    logging.info("Checked/Created 'confessions' table.")
+
+    # Ensure photo_file_id column exists (for backward compatibility)
+    await conn.execute("""
+        DO $$ 
+        BEGIN
+            IF NOT EXISTS (SELECT 1 FROM information_schema.columns 
+                          WHERE table_name='confessions' AND column_name='photo_file_id') THEN
+                ALTER TABLE confessions ADD COLUMN photo_file_id TEXT NULL;
+            END IF;
+        END $$;
+    """)
+    logging.info("Ensured photo_file_id column exists.")
+
+    # --- Comments Table ---
+    await conn.execute("""
+        CREATE TABLE IF NOT EXISTS comments (
+            id SERIAL PRIMARY KEY,
+            confession_id INTEGER NOT NULL REFERENCES confessions(id) ON DELETE CASCADE,
+            user_id BIGINT NOT NULL,
+            text TEXT NULL,
+            sticker_file_id TEXT NULL,
+            animation_file_id TEXT NULL,
+            parent_comment_id INTEGER NULL REFERENCES comments(id) ON DELETE SET NULL,
+            created_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP,
+            likes INTEGER NOT NULL DEFAULT 0,
+            dislikes INTEGER NOT NULL DEFAULT 0
+        );
+    """)
+    logging.info("Checked/Created 'comments' table.")
+
+    # --- Reactions Table ---
+    await conn.execute("""
+         CREATE TABLE IF NOT EXISTS reactions ( id SERIAL PRIMARY KEY, comment_id INTEGER REFERENCES comments(id) ON DELETE CASCADE,
+             user_id BIGINT NOT NULL, reaction_type VARCHAR(10) NOT NULL, created_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP,
+             UNIQUE(comment_id, user_id) );
+    """)
+    logging.info("Checked/Created 'reactions' table.")
+
+    # Reaction counts are denormalized onto comments so renders never aggregate the reactions table.
+    # Older databases get the columns added and backfilled once.
+    await conn.execute("""
+        DO $$
+        BEGIN
+            IF NOT EXISTS (SELECT 1 FROM information_schema.columns
+                          WHERE table_name='comments' AND column_name='likes') THEN
+                ALTER TABLE comments ADD COLUMN likes INTEGER NOT NULL DEFAULT 0,
+                                     ADD COLUMN dislikes INTEGER NOT NULL DEFAULT 0;
+                UPDATE comments c SET likes = r.likes, dislikes = r.dislikes
+                FROM (SELECT comment_id,
+                             COUNT(*) FILTER (WHERE reaction_type = 'like') AS likes,
+                             COUNT(*) FILTER (WHERE reaction_type = 'dislike') AS dislikes
+                      FROM reactions GROUP BY comment_id) r
+                WHERE r.comment_id = c.id;
+            END IF;
+        END $$;
+    """)
+    logging.info("Ensured comment reaction count columns exist.")
+
+    # The counters are kept in step with the reactions table by a trigger, so every insert, change
+    # or delete of a reaction (including cascades) adjusts them without extra statements from the bot.
+    await conn.execute("""
+        CREATE OR REPLACE FUNCTION sync_comment_reaction_counts() RETURNS trigger AS $$
+        BEGIN
+            IF TG_OP IN ('DELETE', 'UPDATE') THEN
+                UPDATE comments SET likes = likes - (OLD.reaction_type = 'like')::int,
+                                    dislikes = dislikes - (OLD.reaction_type = 'dislike')::int
+                WHERE id = OLD.comment_id;
+            END IF;
+            IF TG_OP IN ('INSERT', 'UPDATE') THEN
+                UPDATE comments SET likes = likes + (NEW.reaction_type = 'like')::int,
+                                    dislikes = dislikes + (NEW.reaction_type = 'dislike')::int
+                WHERE id = NEW.comment_id;
+            END IF;
+            RETURN NULL;
+        END $$ LANGUAGE plpgsql;
+
+        DROP TRIGGER IF EXISTS trg_reactions_sync_counts ON reactions;
+        CREATE TRIGGER trg_reactions_sync_counts
+            AFTER INSERT OR DELETE OR UPDATE OF reaction_type ON reactions
+            FOR EACH ROW EXECUTE FUNCTION sync_comment_reaction_counts();
+    """)
+    logging.info("Checked/Created reaction count trigger.")
+
+    # --- Rebuilt Contact Requests Table ---
+    await conn.execute("""
+        CREATE TABLE IF NOT EXISTS contact_requests (
+            id SERIAL PRIMARY KEY,
+            confession_id INTEGER NOT NULL REFERENCES confessions(id) ON DELETE CASCADE,
+            comment_id INTEGER NOT NULL REFERENCES comments(id) ON DELETE CASCADE,
+            requester_user_id BIGINT NOT NULL,
+            requested_user_id BIGINT NOT NULL,
+            status VARCHAR(20) NOT NULL DEFAULT 'pending', -- pending, approved, denied, approved_no_username, failed_to_notify
+            created_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP,
+            updated_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP,
+            UNIQUE (comment_id, requester_user_id)
+        );
+        COMMENT ON TABLE contact_requests IS 'Stores requests from confession authors to contact commenters (V2).';
+    """)
+    logging.info("Checked/Created 'contact_requests' table (V2).")
+
+    # --- User Points Table ---
+    await conn.execute("""
+        CREATE TABLE IF NOT EXISTS user_points (
+            user_id BIGINT PRIMARY KEY,
+            points INTEGER NOT NULL DEFAULT 0
+        );
+        -- user_id is the primary key; a second index on it only slowed down every points upsert
+        DROP INDEX IF EXISTS idx_user_points_user_id;
+    """)
+    logging.info("Checked/Created 'user_points' table.")
+
+    # --- Reports Table ---
+    await conn.execute("""
+        CREATE TABLE IF NOT EXISTS reports (
+            id SERIAL PRIMARY KEY,
+            comment_id INTEGER NOT NULL REFERENCES comments(id) ON DELETE CASCADE,
+            reporter_user_id BIGINT NOT NULL,
+            reported_user_id BIGINT NOT NULL,
+            status VARCHAR(20) NOT NULL DEFAULT 'pending',
+            created_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP,
+            UNIQUE (comment_id, reporter_user_id)
+        );
+    """)
+    logging.info("Checked/Created 'reports' table.")
+
+    # --- Deletion Requests Table ---
+    await conn.execute("""
+        CREATE TABLE IF NOT EXISTS deletion_requests (
+            id SERIAL PRIMARY KEY,
+            confession_id INTEGER NOT NULL REFERENCES confessions(id) ON DELETE CASCADE,
+            user_id BIGINT NOT NULL,
+            status VARCHAR(20) NOT NULL DEFAULT 'pending', -- pending, approved, rejected
+            created_at TIMESTAMP WITH TIME ZONE,
+            reviewed_at TIMESTAMP WITH TIME ZONE,
+            UNIQUE (confession_id, user_id) -- User can only request deletion for their confession once
+        );
+        COMMENT ON TABLE deletion_requests IS 'Stores user requests to delete their own confessions.';
+    """)
+    logging.info("Checked/Created 'deletion_requests' table.")
+
+    # --- NEW: User Status Table (for rules acceptance and blocking) ---
+    await conn.execute("""
+        CREATE TABLE IF NOT EXISTS user_status (
+            user_id BIGINT PRIMARY KEY,
+            has_accepted_rules BOOLEAN NOT NULL DEFAULT FALSE,
+            is_blocked BOOLEAN NOT NULL DEFAULT FALSE,
+            blocked_until TIMESTAMP WITH TIME ZONE NULL,
+            block_reason TEXT NULL
+        );
+    """)
+    logging.info("Checked/Created 'user_status' table.")
+
+    # --- Indexes for hot query paths ---
+    # Comment pages, comment counts and sequence numbers all filter by confession and order by creation time
+    await conn.execute("""
+        CREATE INDEX IF NOT EXISTS idx_comments_conf_created ON comments(confession_id, created_at, id);
+    """)
+    # Deleting a comment (directly or via a confession cascade) nulls out replies' parent_comment_id;
+    # without this index every such delete scans the whole comments table
+    await conn.execute("""
+        CREATE INDEX IF NOT EXISTS idx_comments_parent ON comments(parent_comment_id) WHERE parent_comment_id IS NOT NULL;
+    """)
+    # Profile pages and /id count and list a user's own confessions and comments, newest first
+    await conn.execute("""
+        CREATE INDEX IF NOT EXISTS idx_confessions_user_created ON confessions(user_id, created_at DESC);
+        CREATE INDEX IF NOT EXISTS idx_comments_user_created ON comments(user_id, created_at DESC);
+    """)
+    logging.info("Checked/Created hot path indexes.")
 
 
 # --- Dummy HTTP Server Functions ---
@@ -253,11 +427,20 @@ async def start_dummy_server():
         await runner.cleanup()
         logging.info("Dummy HTTP server cleaned up and stopped.")
 
+def start_health_server_thread():
+    """Runs the dummy HTTP server on its own event loop in a daemon thread, so a busy bot loop can't starve health checks."""
+    thread = threading.Thread(target=lambda: asyncio.run(start_dummy_server()), name="health-server", daemon=True)
+    thread.start()
+    return thread
+
 
 # --- Helper Functions ---
 def create_category_keyboard(selected_categories: List[str] = None):
-    if selected_categories is None:
-        selected_categories = []
+    return _build_category_keyboard(frozenset(selected_categories or ()))
+
+# The markup only depends on which categories are selected, so each selection is built once and reused
+@functools.lru_cache(maxsize=512)
+def _build_category_keyboard(selected_categories: frozenset):
     builder = InlineKeyboardBuilder()
     for category in CATEGORIES:
         prefix = "✅ " if category in selected_categories else ""
@@ -270,40 +453,139 @@ def create_category_keyboard(selected_categories: List[str] = None):
     builder.row(InlineKeyboardButton(text="❌ Cancel Selection", callback_data="category_cancel"))
     return builder.as_markup()
 
-async def get_comment_reactions(comment_id: int) -> Tuple[int, int]:
-    likes, dislikes = 0, 0
-    async with db.acquire() as conn:
-        counts = await conn.fetchrow(
-            "SELECT COALESCE(SUM(CASE WHEN reaction_type = 'like' THEN 1 ELSE 0 END), 0) AS likes, COALESCE(SUM(CASE WHEN reaction_type = 'dislike' THEN 1 ELSE 0 END), 0) AS dislikes FROM reactions WHERE comment_id = $1", comment_id )
-        if counts:
-            likes, dislikes = counts['likes'], counts['dislikes']
-    return likes, dislikes
+# --- Per-user caches are capped so a burst of distinct users can't grow them without bound ---
+USER_CACHE_MAX_ENTRIES = 10_000
+
+def cache_store(cache: "OrderedDict[int, Tuple[float, Any]]", user_id: int, value: Any):
+    """Stores a fresh entry, evicting the least recently stored one once the cache is full."""
+    cache[user_id] = (time.monotonic(), value)
+    cache.move_to_end(user_id)
+    if len(cache) > USER_CACHE_MAX_ENTRIES:
+        cache.popitem(last=False)
+
+# --- User status cache (rules acceptance and blocks), checked on every update by the middleware ---
+USER_STATUS_TTL = 30  # Seconds a cached user_status row stays valid
+GET_USER_STATUS_SQL = "SELECT has_accepted_rules, is_blocked, blocked_until, block_reason FROM user_status WHERE user_id = $1"
+user_status_cache: "OrderedDict[int, Tuple[float, Optional[asyncpg.Record]]]" = OrderedDict()
+
+async def get_user_status(user_id: int) -> Optional[asyncpg.Record]:
+    """Returns the user's user_status row (or None), served from an in-process cache when fresh."""
+    cached = user_status_cache.get(user_id)
+    if cached and time.monotonic() - cached[0] < USER_STATUS_TTL:
+        return cached[1]
+    status = await db.fetchrow(GET_USER_STATUS_SQL, user_id)
+    cache_store(user_status_cache, user_id, status)
+    return status
+
+def invalidate_user_status(user_id: int):
+    """Drops the cached user_status row so the next lookup reads it from the database."""
+    user_status_cache.pop(user_id, None)
+
+# --- User points cache, read by /profile and /id; writers invalidate after changing points ---
+USER_POINTS_TTL = 30  # Seconds a cached points value stays valid
+GET_USER_POINTS_SQL = "SELECT points FROM user_points WHERE user_id = $1"
+# Every statement that awards points ends its user_points insert with this clause: a user without a row gets one,
+# an existing total is added to rather than overwritten
+ADD_USER_POINTS_ON_CONFLICT = "ON CONFLICT (user_id) DO UPDATE SET points = user_points.points + EXCLUDED.points"
+user_points_cache: "OrderedDict[int, Tuple[float, int]]" = OrderedDict()
 
 async def get_user_points(user_id: int) -> int:
-    async with db.acquire() as conn:
-        points = await conn.fetchval("SELECT points FROM user_points WHERE user_id = $1", user_id)
-        return points or 0
+    """Reads a user's points, served from an in-process cache when fresh."""
+    cached = user_points_cache.get(user_id)
+    if cached and time.monotonic() - cached[0] < USER_POINTS_TTL:
+        return cached[1]
+    points = await db.fetchval(GET_USER_POINTS_SQL, user_id) or 0
+    cache_store(user_points_cache, user_id, points)
+    return points
+
+def invalidate_user_points(user_id: int):
+    """Drops the cached points so the next lookup reads them from the database."""
+    user_points_cache.pop(user_id, None)
+
+def build_comment_keyboard(comment_id: int, commenter_user_id: int, viewer_user_id: int, confession_owner_id: int, likes: int, dislikes: int):
+    # Fixed-shape rows are built directly; this runs once per rendered comment
+    rows = [[
+        InlineKeyboardButton(text=f"👍 {likes}", callback_data=ReactionCallback(type="like", comment_id=comment_id).pack()),
+        InlineKeyboardButton(text=f"👎 {dislikes}", callback_data=ReactionCallback(type="dislike", comment_id=comment_id).pack()),
+        InlineKeyboardButton(text="↪️ Reply", callback_data=f"{REPLY_PREFIX}{comment_id}"),
+        InlineKeyboardButton(text="⚠️", callback_data=f"{REPORT_CONFIRM_PREFIX}{comment_id}"),
+    ]]
+    if viewer_user_id == confession_owner_id and viewer_user_id != commenter_user_id:
+        rows.append([InlineKeyboardButton(text="🤝 Request Contact", callback_data=f"{REQ_CONTACT_PREFIX}{comment_id}")])
+    return InlineKeyboardMarkup(inline_keyboard=rows)
 
-async def update_user_points(conn: asyncpg.Connection, user_id: int, delta: int):
-    if delta == 0: return
-    await conn.execute("INSERT INTO user_points (user_id, points) VALUES ($1, $2) ON CONFLICT (user_id) DO UPDATE SET points = user_points.points + $2", user_id, delta)
-    logging.debug(f"Updated points for user {user_id} by {delta}")
 
-async def build_comment_keyboard(comment_id: int, commenter_user_id: int, viewer_user_id: int, confession_owner_id: int ):
-    likes, dislikes = await get_comment_reactions(comment_id)
-    builder = InlineKeyboardBuilder()
-    builder.button(text=f"👍 {likes}", callback_data=f"react_like_{comment_id}")
-    builder.button(text=f"👎 {dislikes}", callback_data=f"react_dislike_{comment_id}")
-    builder.button(text="↪️ Reply", callback_data=f"reply_{comment_id}")
-    builder.button(text="⚠️", callback_data=f"report_confirm_{comment_id}")
+# Fixed-shape keyboards below are built as plain row lists; no builder layout pass is needed
+def build_review_keyboard(conf_id: int) -> InlineKeyboardMarkup:
+    return InlineKeyboardMarkup(inline_keyboard=[
+        [InlineKeyboardButton(text="✅ Approve", callback_data=f"approve_{conf_id}")],
+        [InlineKeyboardButton(text="❌ Reject", callback_data=f"reject_{conf_id}")]
+    ])
 
-    if viewer_user_id == confession_owner_id and viewer_user_id != commenter_user_id:
-        builder.button(text="🤝 Request Contact", callback_data=f"req_contact_{comment_id}")
-        builder.adjust(4, 1)
-    else:
-        builder.adjust(4)
-    return builder.as_markup()
+def build_confession_view_keyboard(conf_id: int, comment_count: int) -> InlineKeyboardMarkup:
+    return InlineKeyboardMarkup(inline_keyboard=[
+        [InlineKeyboardButton(text="➕ Add Comment", callback_data=f"{ADD_COMMENT_PREFIX}{conf_id}")],
+        [InlineKeyboardButton(text=f"💬 Browse Comments ({comment_count})", callback_data=f"{BROWSE_PREFIX}{conf_id}")]
+    ])
 
+# --- Bot-wide limits on Telegram message output, enforced for every send/edit by TelegramRateLimitMiddleware ---
+TG_MAX_CONCURRENT_SENDS = 25  # Requests in flight at once
+TG_SENDS_PER_SECOND = 28  # Kept just below Telegram's ~30 messages/second global limit
+tg_send_semaphore: Optional[asyncio.Semaphore] = None  # Created in setup() once the event loop is running
+tg_send_limiter: Optional["TokenBucket"] = None  # Created in setup() once the event loop is running
+
+class TokenBucket:
+    """Async token bucket: refills at `rate` tokens per second up to `capacity`."""
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.lock = asyncio.Lock()
+
+    async def acquire(self):
+        while True:
+            # The lock only covers the refill and take; waiting happens outside it so sleepers don't block each other
+            async with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            await asyncio.sleep(wait)
+
+# Telegram's limit applies to message output; callback answers, getMe, webhook setup, deletes etc. pass straight
+# through so they never queue behind a burst of sends (a delayed callback answer expires as "query is too old")
+THROTTLED_METHODS = (
+    SendMessage, SendPhoto, SendSticker, SendAnimation, SendVideo, SendDocument, SendMediaGroup,
+    CopyMessage, ForwardMessage, EditMessageText, EditMessageCaption, EditMessageMedia, EditMessageReplyMarkup,
+)
+
+class TelegramRateLimitMiddleware(BaseRequestMiddleware):
+    """Routes every message send/copy/forward/edit through the shared rate limiter and send semaphore."""
+    async def __call__(self, make_request, bot: Bot, method):
+        if not isinstance(method, THROTTLED_METHODS):
+            return await make_request(bot, method)
+        await tg_send_limiter.acquire()
+        async with tg_send_semaphore:
+            return await make_request(bot, method)
+
+# --- Fire-and-forget notifications ---
+background_tasks = set()  # Strong references so pending tasks are not garbage collected
+
+def run_in_background(coro):
+    """Schedules a coroutine without waiting for it, e.g. a notification the current handler does not depend on."""
+    task = asyncio.create_task(coro)
+    background_tasks.add(task)
+    task.add_done_callback(_background_task_done)
+    return task
+
+def _background_task_done(task: asyncio.Task):
+    background_tasks.discard(task)
+    if not task.cancelled() and task.exception():
+        logging.error(f"Background task failed: {task.exception()}", exc_info=task.exception())
 
 # --- MODIFIED: This function now returns the Message object on success, or None on failure ---
 async def safe_send_message(user_id: int, text: str, **kwargs) -> Optional[types.Message]:
@@ -328,13 +610,15 @@ async def safe_send_message(user_id: int, text: str, **kwargs) -> Optional[types
     return None
 
 async def update_channel_post_button(confession_id: int):
-    global bot_info; await asyncio.sleep(0.1)
-    if not bot_info: logging.error(f"No bot info for {confession_id} button update."); return
-    async with db.acquire() as conn:
-        conf_data = await conn.fetchrow("SELECT message_id FROM confessions WHERE id = $1 AND status = 'approved'", confession_id)
-        count = await conn.fetchval("SELECT COUNT(*) FROM comments WHERE confession_id = $1", confession_id) or 0
-    if not conf_data or not conf_data['message_id']: logging.debug(f"No approved conf/msg_id for {conf_id} button."); return
-    ch_msg_id = conf_data['message_id']; link = f"https://t.me/{bot_info.username}?start=view_{confession_id}"
+    await asyncio.sleep(0.1)
+    # The channel message id and the comment count come back in one round trip
+    conf_data = await db.fetchrow(
+        "SELECT message_id, (SELECT COUNT(*) FROM comments WHERE confession_id = $1) AS comment_count FROM confessions WHERE id = $1 AND status = 'approved'",
+        confession_id
+    )
+    if not conf_data or not conf_data['message_id']: logging.debug(f"No approved conf/msg_id for {confession_id} button."); return
+    count = conf_data['comment_count']
+    ch_msg_id = conf_data['message_id']; link = await confession_view_link(confession_id)
     markup = InlineKeyboardMarkup(inline_keyboard=[[InlineKeyboardButton(text=f"💬 View / Add Comments ({count})", url=link)]])
     try: await bot.edit_message_reply_markup(chat_id=CHANNEL_ID, message_id=ch_msg_id, reply_markup=markup)
     except TelegramBadRequest as e:
@@ -343,26 +627,50 @@ async def update_channel_post_button(confession_id: int):
         else: logging.error(f"Failed edit channel post {ch_msg_id} for conf {confession_id}: {e}")
     except Exception as e: logging.error(f"Unexpected err updating btn for conf {confession_id}: {e}", exc_info=True)
 
-# --- NEW: Helper function to get a comment's sequential number ---
-async def get_comment_sequence_number(conn: asyncpg.Connection, comment_id: int, confession_id: int) -> Optional[int]:
-    """Fetches the sequential number of a specific comment within its confession."""
+# --- Helper function to get the sequential numbers of several comments in one query ---
+async def get_comment_sequence_numbers(conn: asyncpg.Connection, confession_id: int, comment_ids: List[int]) -> Dict[int, int]:
+    """Fetches the sequential numbers of the given comments within their confession."""
+    if not comment_ids: return {}
     query = """
         WITH ranked_comments AS (
-            SELECT id, ROW_NUMBER() OVER (ORDER BY created_at ASC) as rn
+            SELECT id, ROW_NUMBER() OVER (ORDER BY created_at ASC, id ASC) as rn
             FROM comments
             WHERE confession_id = $1
         )
-        SELECT rn FROM ranked_comments WHERE id = $2;
+        SELECT id, rn FROM ranked_comments WHERE id = ANY($2::int[]);
     """
     try:
-        seq_num = await conn.fetchval(query, confession_id, comment_id)
-        return seq_num
+        rows = await conn.fetch(query, confession_id, comment_ids)
+        return {row['id']: row['rn'] for row in rows}
     except Exception as e:
-        logging.error(f"Could not fetch sequence number for comment {comment_id}: {e}")
-        return None
+        logging.error(f"Could not fetch sequence numbers for comments {comment_ids}: {e}")
+        return {}
+
+# --- Comment page cursors (keyset pagination) ---
+# A page is addressed by the comment it starts after (Next) or ends before (Prev), ordered by (created_at, id),
+# so every page is an index range scan no matter how deep it is. `offset` only numbers the comments for display.
+COMMENTS_PAGE_ORDER = {
+    None: ("", "ASC"),
+    "after": ("AND (c.created_at, c.id) > (SELECT created_at, id FROM comments WHERE id = $3)", "ASC"),
+    "before": ("AND (c.created_at, c.id) < (SELECT created_at, id FROM comments WHERE id = $3)", "DESC"),
+}
+# Page queries are rendered once per cursor kind, so every call passes asyncpg the same text and hits its statement cache.
+# Reaction counts are stored on the comment rows, so the page needs no per-comment lookups.
+COMMENTS_PAGE_SQL = {
+    kind: f"""
+        SELECT c.id, c.user_id, c.text, c.sticker_file_id, c.animation_file_id, c.parent_comment_id, c.created_at,
+               COALESCE(up.points, 0) as user_points, c.likes, c.dislikes
+        FROM comments c
+        LEFT JOIN user_points up ON c.user_id = up.user_id
+        WHERE c.confession_id = $1 {cursor_filter}
+        ORDER BY c.created_at {sort_dir}, c.id {sort_dir} LIMIT $2
+    """
+    for kind, (cursor_filter, sort_dir) in COMMENTS_PAGE_ORDER.items()
+}
 
 # --- MODIFIED: Reworked show_comments_for_confession to be more specific about cross-page replies ---
-async def show_comments_for_confession(user_id: int, confession_id: int, message_to_edit: Optional[types.Message] = None, page: int = 1):
+async def show_comments_for_confession(user_id: int, confession_id: int, message_to_edit: Optional[types.Message] = None,
+                                       after_id: Optional[int] = None, before_id: Optional[int] = None, offset: int = 0):
     async with db.acquire() as conn:
         conf_data = await conn.fetchrow("SELECT status, user_id FROM confessions WHERE id = $1", confession_id)
         if not conf_data or conf_data['status'] != 'approved':
@@ -371,62 +679,79 @@ async def show_comments_for_confession(user_id: int, confession_id: int, message
             else: await safe_send_message(user_id, err_txt)
             return
         confession_owner_id = conf_data['user_id']
-        total_count = await conn.fetchval("SELECT COUNT(*) FROM comments WHERE confession_id = $1", confession_id) or 0
-        if total_count == 0:
+
+        offset = max(0, offset); page = offset // PAGE_SIZE + 1
+        cursor_kind = "after" if after_id else "before" if before_id else None
+        cursor_args = (after_id or before_id,) if cursor_kind else ()
+        comments_raw = await conn.fetch(COMMENTS_PAGE_SQL[cursor_kind], confession_id, PAGE_SIZE + 1, *cursor_args)
+        if not comments_raw and cursor_kind:
+            # The cursor comment was deleted (the seek then matches nothing) or nothing is left past it: show the first page
+            cursor_kind, offset, page = None, 0, 1
+            comments_raw = await conn.fetch(COMMENTS_PAGE_SQL[None], confession_id, PAGE_SIZE + 1)
+        sort_dir = COMMENTS_PAGE_ORDER[cursor_kind][1]
+        # One extra row is fetched as a lookahead: going forward it means a next page exists; going back we came from one
+        has_next = len(comments_raw) > PAGE_SIZE or sort_dir == "DESC"
+        comments_raw = comments_raw[:PAGE_SIZE]
+        if sort_dir == "DESC": comments_raw = comments_raw[::-1]
+        # An empty first page means the confession has no comments at all; no COUNT(*) is needed to tell
+        if not comments_raw and cursor_kind is None:
             msg_text = "<i>No comments yet. Be the first!</i>"
             if message_to_edit: await message_to_edit.edit_text(msg_text, reply_markup=None)
             else: await safe_send_message(user_id, msg_text)
-            nav = InlineKeyboardMarkup(inline_keyboard=[[InlineKeyboardButton(text="➕ Add Comment", callback_data=f"add_{confession_id}")]])
+            nav = InlineKeyboardMarkup(inline_keyboard=[[InlineKeyboardButton(text="➕ Add Comment", callback_data=f"{ADD_COMMENT_PREFIX}{confession_id}")]])
             await safe_send_message(user_id, "You can add your own comment below:", reply_markup=nav)
             return
 
-        total_pages = (total_count + PAGE_SIZE - 1) // PAGE_SIZE; page = max(1, min(page, total_pages)); offset = (page - 1) * PAGE_SIZE
-        comments_raw = await conn.fetch("SELECT c.id, c.user_id, c.text, c.sticker_file_id, c.animation_file_id, c.parent_comment_id, c.created_at, COALESCE(up.points, 0) as user_points FROM comments c LEFT JOIN user_points up ON c.user_id = up.user_id WHERE c.confession_id = $1 ORDER BY c.created_at ASC LIMIT $2 OFFSET $3", confession_id, PAGE_SIZE, offset)
+        # Sequence numbers of comments on this page are known from the offset; only parents on other pages need a lookup
+        seq_by_db_id: Dict[int, int] = {row['id']: offset + i + 1 for i, row in enumerate(comments_raw)}
+        off_page_parent_ids = list({row['parent_comment_id'] for row in comments_raw if row['parent_comment_id'] and row['parent_comment_id'] not in seq_by_db_id})
+        seq_by_db_id.update(await get_comment_sequence_numbers(conn, confession_id, off_page_parent_ids))
+
+    # Build every comment's metadata line and keyboard up front, then send. Sends stay sequential on purpose:
+    # chat order must match comment order and replies thread onto message ids returned by earlier sends.
+    is_admin = user_id == ADMIN_ID
+    tag_by_uid = {user_id: "(You)", confession_owner_id: "(Author)"}  # Author wins when the viewer owns the confession
+    payloads = []
+    for i, c_data_row in enumerate(comments_raw):
+        c_data = dict(c_data_row)
+        seq_num, db_id, commenter_uid = offset + i + 1, c_data['id'], c_data['user_id']
+        tag = tag_by_uid.get(commenter_uid, "Anonymous")
+        admin_info = f" [UID: <code>{commenter_uid}</code>]" if is_admin else ""
+        metadata_text = f"<i>#{seq_num} {tag} 🏅{c_data['user_points']} Aura{admin_info}</i>"
+        keyboard = build_comment_keyboard(db_id, commenter_uid, user_id, confession_owner_id, c_data['likes'], c_data['dislikes'])
+        payloads.append((seq_num, c_data, metadata_text, keyboard))
 
     db_id_to_message_id: Dict[int, int] = {}
 
-    if not comments_raw:
+    if not payloads:
         await safe_send_message(user_id, f"<i>No comments on page {page}.</i>")
     else:
-        for i, c_data_row in enumerate(comments_raw):
-            c_data = dict(c_data_row)
-            seq_num, db_id, commenter_uid = offset + i + 1, c_data['id'], c_data['user_id']
-            ts = c_data['created_at'].strftime("%Y-%m-%d %H:%M")
-            medal_str = f" 🏅{c_data.get('user_points', 0)} Aura"
-            tag = "(Author)" if commenter_uid == confession_owner_id else "(You)" if commenter_uid == user_id else "Anonymous"
-            admin_info = f" [UID: <code>{commenter_uid}</code>]" if user_id == ADMIN_ID else ""
-            display_tag = f" {tag}{medal_str}"
-
+        for seq_num, c_data, metadata_text, keyboard in payloads:
+            db_id = c_data['id']
             reply_to_msg_id = None
             text_reply_prefix = ""
             parent_db_id = c_data.get('parent_comment_id')
             if parent_db_id:
                 if parent_db_id in db_id_to_message_id:
                     reply_to_msg_id = db_id_to_message_id[parent_db_id]
-                else: 
-                    # --- MODIFICATION START ---
-                    # Parent comment is on another page, so we fetch its sequence number
-                    async with db.acquire() as conn_for_seq: # Use a new connection from the pool
-                        parent_seq_num = await get_comment_sequence_number(conn_for_seq, parent_db_id, confession_id)
-                    
+                else:
+                    # Parent comment is on another page (or failed to send), so we show its sequence number
+                    parent_seq_num = seq_by_db_id.get(parent_db_id)
                     if parent_seq_num:
                         text_reply_prefix = f"↪️ <i>Replying to comment #{parent_seq_num}...</i>\n"
                     else:
                         # Fallback if the parent comment was deleted or an error occurred
                         text_reply_prefix = "↪️ <i>Replying to another comment...</i>\n"
-                    # --- MODIFICATION END ---
 
-            metadata_text = f"<i>#{seq_num}{display_tag}{admin_info}</i>"
-            keyboard = await build_comment_keyboard(db_id, commenter_uid, user_id, confession_owner_id)
-            
             sent_message = None
             try:
+                # Stickers and GIFs can't carry the metadata text, so it follows as a silent reply attached to the media
                 if c_data['sticker_file_id']:
                     sent_message = await bot.send_sticker(user_id, sticker=c_data['sticker_file_id'], reply_to_message_id=reply_to_msg_id)
-                    await bot.send_message(user_id, f"{text_reply_prefix}{metadata_text}", reply_markup=keyboard)
+                    await bot.send_message(user_id, f"{text_reply_prefix}{metadata_text}", reply_markup=keyboard, reply_to_message_id=sent_message.message_id, disable_notification=True)
                 elif c_data['animation_file_id']:
                     sent_message = await bot.send_animation(user_id, animation=c_data['animation_file_id'], reply_to_message_id=reply_to_msg_id)
-                    await bot.send_message(user_id, f"{text_reply_prefix}{metadata_text}", reply_markup=keyboard)
+                    await bot.send_message(user_id, f"{text_reply_prefix}{metadata_text}", reply_markup=keyboard, reply_to_message_id=sent_message.message_id, disable_notification=True)
                 elif c_data['text']:
                     full_text = f"{text_reply_prefix}💬 {html.quote(c_data['text'])}\n\n{metadata_text}"
                     sent_message = await bot.send_message(user_id, full_text, reply_markup=keyboard, disable_web_page_preview=True, reply_to_message_id=reply_to_msg_id)
@@ -437,14 +762,13 @@ async def show_comments_for_confession(user_id: int, confession_id: int, message
             except Exception as e:
                 logging.warning(f"Could not send comment #{seq_num} to {user_id}: {e}")
                 await safe_send_message(user_id, f"⚠️ Error displaying comment #{seq_num}.")
-            await asyncio.sleep(0.1)
 
     nav_row = []
-    if page > 1: nav_row.append(InlineKeyboardButton(text="⬅️ Prev", callback_data=f"comments_page_{confession_id}_{page-1}"))
-    if total_pages > 1: nav_row.append(InlineKeyboardButton(text=f"Page {page}/{total_pages}", callback_data="noop"))
-    if page < total_pages: nav_row.append(InlineKeyboardButton(text="Next ➡️", callback_data=f"comments_page_{confession_id}_{page+1}"))
-    nav_keyboard = InlineKeyboardMarkup(inline_keyboard=[nav_row, [InlineKeyboardButton(text="➕ Add Comment", callback_data=f"add_{confession_id}")]])
-    end_txt = f"--- Showing comments {offset+1} to {min(offset+PAGE_SIZE, total_count)} of {total_count} for Confession #{confession_id} ---"
+    if offset > 0 and comments_raw: nav_row.append(InlineKeyboardButton(text="⬅️ Prev", callback_data=f"comments_prev_{confession_id}_{comments_raw[0]['id']}_{max(0, offset - PAGE_SIZE)}"))
+    if offset > 0 or has_next: nav_row.append(InlineKeyboardButton(text=f"Page {page}", callback_data="noop"))
+    if comments_raw and has_next: nav_row.append(InlineKeyboardButton(text="Next ➡️", callback_data=f"comments_next_{confession_id}_{comments_raw[-1]['id']}_{offset + len(comments_raw)}"))
+    nav_keyboard = InlineKeyboardMarkup(inline_keyboard=[nav_row, [InlineKeyboardButton(text="➕ Add Comment", callback_data=f"{ADD_COMMENT_PREFIX}{confession_id}")]])
+    end_txt = f"--- Showing comments {offset+1} to {offset+len(comments_raw)} for Confession #{confession_id} ---"
     await safe_send_message(user_id, end_txt, reply_markup=nav_keyboard)
 
 
@@ -460,15 +784,14 @@ class BlockUserMiddleware(BaseMiddleware):
         if user_id == ADMIN_ID:
             return await handler(event, data)
 
-        async with db.acquire() as conn:
-            status = await conn.fetchrow("SELECT is_blocked, blocked_until, block_reason FROM user_status WHERE user_id = $1", user_id)
+        status = await get_user_status(user_id)
         
         if status and status['is_blocked']:
             now = datetime.now(datetime.utcnow().astimezone().tzinfo)
             if status['blocked_until'] and status['blocked_until'] < now:
                 # Unblock expired temporary blocks
-                async with db.acquire() as conn:
-                    await conn.execute("UPDATE user_status SET is_blocked = FALSE, blocked_until = NULL, block_reason = NULL WHERE user_id = $1", user_id)
+                await db.execute("UPDATE user_status SET is_blocked = FALSE, blocked_until = NULL, block_reason = NULL WHERE user_id = $1", user_id)
+                invalidate_user_status(user_id)
                 return await handler(event, data)
             else:
                 # User is currently blocked
@@ -487,21 +810,66 @@ class BlockUserMiddleware(BaseMiddleware):
 
 # --- Handlers ---
 
+# --- Static message texts, built once at import ---
+RULES_TEXT = (
+    "<b>📜 Bot Rules & Regulations</b>\n\n"
+    "<b>To keep the community safe, respectful, and meaningful, please follow these guidelines when using the bot:</b>\n\n"
+    "1.  <b>Stay Relevant:</b> This space is mainly for sharing confessions, experiences, and thoughts.\n\n - Avoid using it just to ask random questions you could easily Google or ask in the right place.\n\n - Some student-related questions may be approved if they benefit the community.\n\n"
+    "2.  <b>Respectful Communication:</b> Sensitive topics (political, religious, cultural, etc.) are allowed but must be discussed with respect.\n\n"
+    "3.  <b>No Harmful Content:</b> You may mention names, but at your own risk.\n\n - The bot and admins are not responsible for any consequences.\n\n - If someone mentioned requests removal, their name will be taken down.\n\n"
+    "4.  <b>Names & Responsibility:</b> Do not share personal identifying information about yourself or others.\n\n"
+    "5.  <b>Anonymity & Privacy:</b> don't reveal private details of others (contacts, adress, etc.) without consent.\n\n"
+    "6.  <b>Constructive Environment:</b> Keep confessions genuine. Avoid spam, trolling, or repeated submissions.\n\n - Respect moderators' decisions on approvals, edits, or removals.\n\n\n"
+    "<i>Use this space to connect, share, and learn, not to spread misinformation or cause unnecessary drama.</i>"
+)
+WELCOME_TEXT = "Welcome! Use /confess to share anonymously, /profile to see your history, or /help for more info."
+PROFILE_TEMPLATE = "👤 <b>Your Profile</b>\n\n🏅 <b>Medal Points (Aura):</b> {points}"
+
+# --- Static keyboards, shared by every message that shows them ---
+ACCEPT_RULES_KEYBOARD = InlineKeyboardMarkup(inline_keyboard=[
+    [InlineKeyboardButton(text="✅ I Accept the Rules", callback_data="accept_rules")]
+])
+HELP_ACTIONS_KEYBOARD = InlineKeyboardMarkup(inline_keyboard=[
+    [InlineKeyboardButton(text="📜 Rules & Regulations", callback_data="show_rules_help")],
+    [InlineKeyboardButton(text="✉️ Contact Admin", callback_data="contact_admin_start")]
+])
+PROFILE_MENU_KEYBOARD = InlineKeyboardMarkup(inline_keyboard=[
+    [InlineKeyboardButton(text="📜 My Confessions", callback_data="profile_menu_confessions_1")],
+    [InlineKeyboardButton(text="💬 My Comments", callback_data="profile_menu_comments_1")]
+])
+CANCEL_REPLY_KEYBOARD = ReplyKeyboardMarkup(keyboard=[[KeyboardButton(text="/cancel")]], resize_keyboard=True, one_time_keyboard=True)
+REJECTION_REASON_KEYBOARD = ReplyKeyboardMarkup(
+    keyboard=[
+        [KeyboardButton(text="/skip")],
+        [KeyboardButton(text="/cancel")]
+    ],
+    resize_keyboard=True,
+    one_time_keyboard=True
+)
+REMOVE_REPLY_KEYBOARD = ReplyKeyboardRemove()
+
+# --- Bot command menus, registered once at startup ---
+BOT_COMMANDS = [
+    types.BotCommand(command="start", description="Start/View confession"),
+    types.BotCommand(command="confess", description="Submit anonymous confession (text or photo)"),
+    types.BotCommand(command="profile", description="View your profile and history"),
+    types.BotCommand(command="help", description="Show help and commands"),
+    types.BotCommand(command="rules", description="View the bot's rules"),
+    types.BotCommand(command="privacy", description="View privacy information"),
+    types.BotCommand(command="cancel", description="Cancel current action"),
+]
+ADMIN_BOT_COMMANDS = BOT_COMMANDS + [
+    types.BotCommand(command="id", description="ADMIN: Get user info"),
+    types.BotCommand(command="warn", description="ADMIN: Warn a user"),
+    types.BotCommand(command="block", description="ADMIN: Temporarily block a user"),
+    types.BotCommand(command="pblock", description="ADMIN: Permanently block a user"),
+    types.BotCommand(command="unblock", description="ADMIN: Unblock a user"),
+]
+
 # --- NEW: Rules and Regulations Handler ---
 @dp.message(Command("rules"))
 async def show_rules(message: types.Message):
-    rules_text = (
-        "<b>📜 Bot Rules & Regulations</b>\n\n"
-        "<b>To keep the community safe, respectful, and meaningful, please follow these guidelines when using the bot:</b>\n\n"
-        "1.  <b>Stay Relevant:</b> This space is mainly for sharing confessions, experiences, and thoughts.\n\n - Avoid using it just to ask random questions you could easily Google or ask in the right place.\n\n - Some student-related questions may be approved if they benefit the community.\n\n"
-        "2.  <b>Respectful Communication:</b> Sensitive topics (political, religious, cultural, etc.) are allowed but must be discussed with respect.\n\n"
-        "3.  <b>No Harmful Content:</b> You may mention names, but at your own risk.\n\n - The bot and admins are not responsible for any consequences.\n\n - If someone mentioned requests removal, their name will be taken down.\n\n"
-        "4.  <b>Names & Responsibility:</b> Do not share personal identifying information about yourself or others.\n\n"
-        "5.  <b>Anonymity & Privacy:</b> don't reveal private details of others (contacts, adress, etc.) without consent.\n\n"
-        "6.  <b>Constructive Environment:</b> Keep confessions genuine. Avoid spam, trolling, or repeated submissions.\n\n - Respect moderators' decisions on approvals, edits, or removals.\n\n\n"
-        "<i>Use this space to connect, share, and learn, not to spread misinformation or cause unnecessary drama.</i>"
-    )
-    await message.answer(rules_text)
+    await message.answer(RULES_TEXT)
 
 @dp.message(Command("start"))
 async def start(message: types.Message, state: FSMContext, command: Optional[CommandObject] = None):
@@ -509,25 +877,11 @@ async def start(message: types.Message, state: FSMContext, command: Optional[Com
     user_id = message.from_user.id
 
     # --- NEW: Rules acceptance check ---
-    async with db.acquire() as conn:
-        has_accepted = await conn.fetchval("SELECT has_accepted_rules FROM user_status WHERE user_id = $1", user_id)
+    status = await get_user_status(user_id)
+    has_accepted = status['has_accepted_rules'] if status else False
 
     if not has_accepted:
-        rules_text = (
-                    "<b>📜 Bot Rules & Regulations</b>\n\n"
-        "<b>To keep the community safe, respectful, and meaningful, please follow these guidelines when using the bot:</b>\n\n"
-        "1.  <b>Stay Relevant:</b> This space is mainly for sharing confessions, experiences, and thoughts.\n\n - Avoid using it just to ask random questions you could easily Google or ask in the right place.\n\n - Some student-related questions may be approved if they benefit the community.\n\n"
-        "2.  <b>Respectful Communication:</b> Sensitive topics (political, religious, cultural, etc.) are allowed but must be discussed with respect.\n\n"
-        "3.  <b>No Harmful Content:</b> You may mention names, but at your own risk.\n\n - The bot and admins are not responsible for any consequences.\n\n - If someone mentioned requests removal, their name will be taken down.\n\n"
-        "4.  <b>Names & Responsibility:</b> Do not share personal identifying information about yourself or others.\n\n"
-        "5.  <b>Anonymity & Privacy:</b> don't reveal private details of others (contacts, adress, etc.) without consent.\n\n"
-        "6.  <b>Constructive Environment:</b> Keep confessions genuine. Avoid spam, trolling, or repeated submissions.\n\n - Respect moderators' decisions on approvals, edits, or removals.\n\n\n"
-        "<i>Use this space to connect, share, and learn, not to spread misinformation or cause unnecessary drama.</i>"
-        )
-        accept_keyboard = InlineKeyboardMarkup(inline_keyboard=[
-            [InlineKeyboardButton(text="✅ I Accept the Rules", callback_data="accept_rules")]
-        ])
-        await message.answer(rules_text, reply_markup=accept_keyboard)
+        await message.answer(RULES_TEXT, reply_markup=ACCEPT_RULES_KEYBOARD)
         return
 
     deep_link_args = command.args if command else None
@@ -535,8 +889,7 @@ async def start(message: types.Message, state: FSMContext, command: Optional[Com
         try:
             conf_id = int(deep_link_args.split("_", 1)[1])
             logging.info(f"User {message.from_user.id} started via deep link for conf {conf_id}")
-            async with db.acquire() as conn:
-                conf_data = await conn.fetchrow("SELECT c.text, c.categories, c.status, c.user_id, c.photo_file_id, COUNT(com.id) as comment_count FROM confessions c LEFT JOIN comments com ON c.id = com.confession_id WHERE c.id = $1 GROUP BY c.id", conf_id)
+            conf_data = await db.fetchrow("SELECT c.text, c.categories, c.status, c.user_id, c.photo_file_id, COUNT(com.id) as comment_count FROM confessions c LEFT JOIN comments com ON c.id = com.confession_id WHERE c.id = $1 GROUP BY c.id", conf_id)
             if not conf_data or conf_data['status'] != 'approved':
                 await message.answer(f"Confession #{conf_id} not found or not approved."); return
             comm_count = conf_data['comment_count']; categories = conf_data['categories'] or []; category_tags = " ".join([f"#{html.quote(cat)}" for cat in categories]) if categories else "#Unknown"
@@ -544,37 +897,31 @@ async def start(message: types.Message, state: FSMContext, command: Optional[Com
             # Check if confession has photo
             if conf_data['photo_file_id']:
                 caption = f"<b>Confession #{conf_id}</b>\n\n{html.quote(conf_data['text'])}\n\n{category_tags}\n---"
-                builder = InlineKeyboardBuilder()
-                builder.button(text="➕ Add Comment", callback_data=f"add_{conf_id}")
-                builder.button(text=f"💬 Browse Comments ({comm_count})", callback_data=f"browse_{conf_id}")
-                builder.adjust(1, 1)
+                kbd = build_confession_view_keyboard(conf_id, comm_count)
                 
                 await bot.send_photo(
                     chat_id=user_id,
                     photo=conf_data['photo_file_id'],
                     caption=caption,
-                    reply_markup=builder.as_markup()
+                    reply_markup=kbd
                 )
             else:
                 txt = f"<b>Confession #{conf_id}</b>\n\n{html.quote(conf_data['text'])}\n\n{category_tags}\n---"
-                builder = InlineKeyboardBuilder()
-                builder.button(text="➕ Add Comment", callback_data=f"add_{conf_id}")
-                builder.button(text=f"💬 Browse Comments ({comm_count})", callback_data=f"browse_{conf_id}")
-                builder.adjust(1, 1)
-                await message.answer(txt, reply_markup=builder.as_markup())
+                kbd = build_confession_view_keyboard(conf_id, comm_count)
+                await message.answer(txt, reply_markup=kbd)
         except (ValueError, IndexError): await message.answer("Invalid link.")
         except Exception as e: logging.error(f"Err handling deep link '{deep_link_args}': {e}", exc_info=True); await message.answer("Error processing link.")
-    else: await message.answer("Welcome! Use /confess to share anonymously, /profile to see your history, or /help for more info.", reply_markup=ReplyKeyboardRemove())
+    else: await message.answer(WELCOME_TEXT, reply_markup=REMOVE_REPLY_KEYBOARD)
 
 @dp.callback_query(F.data == "accept_rules")
 async def handle_accept_rules(callback_query: types.CallbackQuery):
     user_id = callback_query.from_user.id
-    async with db.acquire() as conn:
-        await conn.execute(
-            """INSERT INTO user_status (user_id, has_accepted_rules) VALUES ($1, TRUE)
-               ON CONFLICT (user_id) DO UPDATE SET has_accepted_rules = TRUE""",
-            user_id
-        )
+    await db.execute(
+        """INSERT INTO user_status (user_id, has_accepted_rules) VALUES ($1, TRUE)
+           ON CONFLICT (user_id) DO UPDATE SET has_accepted_rules = TRUE""",
+        user_id
+    )
+    invalidate_user_status(user_id)
     await callback_query.message.edit_text("Thank you for accepting the rules! You can now use the bot.\n\n"
                                           "Use /confess to share anonymously, /profile to see your history, or /help for more info.",
                                           reply_markup=None)
@@ -599,10 +946,6 @@ async def show_help(message: types.Message):
         "Need more info or want to reach the admin directly?"
     )
     # --- MODIFIED: Added Rules button ---
-    action_keyboard = InlineKeyboardMarkup(inline_keyboard=[
-        [InlineKeyboardButton(text="📜 Rules & Regulations", callback_data="show_rules_help")],
-        [InlineKeyboardButton(text="✉️ Contact Admin", callback_data="contact_admin_start")]
-    ])
     if message.from_user and message.from_user.id == ADMIN_ID:
         help_text += ("\n\n<b>Admin Commands:</b>\n"
                       "🔹 /id &lt;user_id&gt; - Get user info.\n"
@@ -611,7 +954,7 @@ async def show_help(message: types.Message):
                       "🔹 /pblock &lt;user_id&gt; [reason] - Permanently block.\n"
                       "🔹 /unblock &lt;user_id&gt; - Unblock a user.")
 
-    await message.answer(help_text, reply_markup=action_keyboard)
+    await message.answer(help_text, reply_markup=HELP_ACTIONS_KEYBOARD)
 
 @dp.callback_query(F.data == "show_rules_help")
 async def show_rules_from_help(callback_query: types.CallbackQuery):
@@ -622,9 +965,8 @@ async def show_rules_from_help(callback_query: types.CallbackQuery):
 @dp.callback_query(F.data == "contact_admin_start", StateFilter(None))
 async def start_contact_admin_callback(callback_query: types.CallbackQuery, state: FSMContext):
     await state.set_state(ContactAdminForm.waiting_for_message)
-    cancel_button = ReplyKeyboardMarkup(keyboard=[[KeyboardButton(text="/cancel")]], resize_keyboard=True, one_time_keyboard=True)
     await callback_query.answer("Please send your message to the admin.")
-    await callback_query.message.answer("Please send the message you want to forward to the admin. The admin will see your message but not your direct profile initially. Type /cancel to abort.", reply_markup=cancel_button)
+    await callback_query.message.answer("Please send the message you want to forward to the admin. The admin will see your message but not your direct profile initially. Type /cancel to abort.", reply_markup=CANCEL_REPLY_KEYBOARD)
 
 @dp.message(Command("privacy"), StateFilter(None))
 async def show_privacy(message: types.Message):
@@ -644,7 +986,7 @@ async def show_privacy(message: types.Message):
 @dp.message(Command("cancel"), StateFilter('*'))
 async def cancel_any_state(message: types.Message, state: FSMContext):
     await state.clear()
-    await message.answer("Action cancelled.", reply_markup=ReplyKeyboardRemove())
+    await message.answer("Action cancelled.", reply_markup=REMOVE_REPLY_KEYBOARD)
 
 @dp.message(ContactAdminForm.waiting_for_message, F.text)
 async def receive_admin_message(message: types.Message, state: FSMContext):
@@ -659,31 +1001,38 @@ async def receive_admin_message(message: types.Message, state: FSMContext):
         f"\n\n---\nReply to this message to respond to User ID <code>{user_id}</code>." )
     try:
         await bot.send_message(ADMIN_ID, admin_message)
-        await message.answer("✅ Your message has been sent to the admin.", reply_markup=ReplyKeyboardRemove())
+        await message.answer("✅ Your message has been sent to the admin.", reply_markup=REMOVE_REPLY_KEYBOARD)
     except Exception as e: logging.error(f"Failed forward msg from {user_id} to admin: {e}"); await message.answer("❌ Error sending message.")
     finally: await state.clear()
 
+# First <code>-wrapped number in a forwarded user message is the sender's user ID
+ADMIN_REPLY_UID_RE = re.compile(r"<code>(\d+)</code>")
+
 @dp.message(F.from_user.id == ADMIN_ID, F.reply_to_message)
 async def handle_admin_reply(message: types.Message, state: FSMContext):
     if await state.get_state() is not None: return
     replied_to = message.reply_to_message
     if replied_to and replied_to.text and "⚠️ New Comment Report" in replied_to.text: return
-    global bot_info;
-    if not bot_info or not replied_to or not replied_to.from_user or replied_to.from_user.id != bot_info.id: return
-    target_user_id = None;
-    try:
-        text_to_search = replied_to.html_text
-        start_index = text_to_search.find("<code>") + len("<code>")
-        end_index = text_to_search.find("</code>", start_index)
-        target_user_id = int(text_to_search[start_index:end_index])
-    except (ValueError, AttributeError):
+    if not replied_to or not replied_to.from_user or replied_to.from_user.id != (await get_bot_info()).id: return
+    match = ADMIN_REPLY_UID_RE.search(replied_to.html_text or "")
+    if not match:
         logging.warning("Could not extract user ID from admin reply context.")
         return
+    target_user_id = int(match.group(1))
     if target_user_id:
         sent = await safe_send_message(target_user_id, f"💬 <b>Admin Reply:</b>\n\n{html.quote(message.text or '')}")
         if sent: await message.reply("✅ Reply sent to the user.")
         else: await message.reply("⚠️ Failed to send reply. User may have blocked the bot.")
 
+# Everything /id reports about a user from the database, in one round trip
+USER_INFO_SQL = """
+    SELECT COALESCE((SELECT points FROM user_points WHERE user_id = $1), 0) AS points,
+           (SELECT COUNT(*) FROM confessions WHERE user_id = $1) AS conf_count,
+           (SELECT COUNT(*) FROM comments WHERE user_id = $1) AS comm_count,
+           us.user_id IS NOT NULL AS has_status, us.is_blocked, us.blocked_until, us.has_accepted_rules
+    FROM (SELECT 1) AS one LEFT JOIN user_status us ON us.user_id = $1
+"""
+
 @dp.message(Command("id"))
 async def get_user_info_command(message: types.Message, command: CommandObject):
     if not message.from_user or message.from_user.id != ADMIN_ID: return
@@ -691,25 +1040,22 @@ async def get_user_info_command(message: types.Message, command: CommandObject):
     try: target_user_id = int(command.args.strip())
     except ValueError: await message.reply("Invalid User ID."); return
     info_parts = [f"ℹ️ <b>User Info for ID:</b> <code>{target_user_id}</code>\n"];
-    try:
-        chat_info = await bot.get_chat(target_user_id)
+    # The Telegram lookup and the database summary are independent, so they run concurrently
+    chat_info, user_data = await asyncio.gather(
+        bot.get_chat(target_user_id), db.fetchrow(USER_INFO_SQL, target_user_id), return_exceptions=True
+    )
+    if isinstance(chat_info, Exception): info_parts.append(f"⚠️ <b>Telegram Details:</b> Could not fetch. (Error: {chat_info})")
+    else:
         info_parts.append(f"<b>Username:</b> @{html.quote(chat_info.username or 'Not Set')}")
         info_parts.append(f"<b>First Name:</b> {html.quote(chat_info.first_name or 'N/A')}")
-    except Exception as e: info_parts.append(f"⚠️ <b>Telegram Details:</b> Could not fetch. (Error: {e})")
-    try:
-        async with db.acquire() as conn:
-            user_points = await get_user_points(target_user_id)
-            conf_count = await conn.fetchval("SELECT COUNT(*) FROM confessions WHERE user_id = $1", target_user_id)
-            comm_count = await conn.fetchval("SELECT COUNT(*) FROM comments WHERE user_id = $1", target_user_id)
-            status_data = await conn.fetchrow("SELECT is_blocked, blocked_until, has_accepted_rules FROM user_status WHERE user_id = $1", target_user_id)
-            
-            info_parts.append(f"\n<b>Bot Interaction:</b>\n  - <b>Medal Points:</b> 🏅 {user_points}\n  - <b>Confessions:</b> {conf_count}\n  - <b>Comments:</b> {comm_count}")
-            if status_data:
-                info_parts.append(f"  - <b>Accepted Rules:</b> {'Yes' if status_data['has_accepted_rules'] else 'No'}")
-                if status_data['is_blocked']:
-                    expiry = f"until {status_data['blocked_until'].strftime('%Y-%m-%d')}" if status_data['blocked_until'] else "Permanently"
-                    info_parts.append(f"  - <b>Status:</b> ❌ Blocked ({expiry})")
-    except Exception as e: info_parts.append(f"\n❌ <b>Bot Interaction:</b> Error fetching database info: {e}")
+    if isinstance(user_data, Exception): info_parts.append(f"\n❌ <b>Bot Interaction:</b> Error fetching database info: {user_data}")
+    else:
+        info_parts.append(f"\n<b>Bot Interaction:</b>\n  - <b>Medal Points:</b> 🏅 {user_data['points']}\n  - <b>Confessions:</b> {user_data['conf_count']}\n  - <b>Comments:</b> {user_data['comm_count']}")
+        if user_data['has_status']:
+            info_parts.append(f"  - <b>Accepted Rules:</b> {'Yes' if user_data['has_accepted_rules'] else 'No'}")
+            if user_data['is_blocked']:
+                expiry = f"until {user_data['blocked_until'].strftime('%Y-%m-%d')}" if user_data['blocked_until'] else "Permanently"
+                info_parts.append(f"  - <b>Status:</b> ❌ Blocked ({expiry})")
     await message.reply("\n".join(info_parts));
 
 # --- /profile Command and Handlers ---
@@ -733,30 +1079,21 @@ async def user_profile(message: types.Message):
     user_id = message.from_user.id
     points = await get_user_points(user_id)
 
-    profile_text = f"👤 <b>Your Profile</b>\n\n🏅 <b>Medal Points (Aura):</b> {points}"
-    keyboard = InlineKeyboardMarkup(inline_keyboard=[
-        [InlineKeyboardButton(text="📜 My Confessions", callback_data="profile_menu_confessions_1")],
-        [InlineKeyboardButton(text="💬 My Comments", callback_data="profile_menu_comments_1")]
-    ])
-    await message.answer(profile_text, reply_markup=keyboard)
+    profile_text = PROFILE_TEMPLATE.format(points=points)
+    await message.answer(profile_text, reply_markup=PROFILE_MENU_KEYBOARD)
 
 @dp.callback_query(F.data.startswith("profile_menu_"))
 async def handle_profile_menu(callback_query: types.CallbackQuery):
     user_id = callback_query.from_user.id
-    parts = callback_query.data.split("_")
-    action = parts[2]
-    # *** FIX: Correctly parse page number from the end of the callback data ***
-    page = int(parts[-1])
+    # profile_menu_<action>_<page>: one split yields both fields
+    _, _, action, page = callback_query.data.split("_", 3)
+    page = int(page)
 
     try:
         if action == "main":
             points = await get_user_points(user_id)
-            profile_text = f"👤 <b>Your Profile</b>\n\n🏅 <b>Medal Points (Aura):</b> {points}"
-            keyboard = InlineKeyboardMarkup(inline_keyboard=[
-                [InlineKeyboardButton(text="📜 My Confessions", callback_data="profile_menu_confessions_1")],
-                [InlineKeyboardButton(text="💬 My Comments", callback_data="profile_menu_comments_1")]
-            ])
-            await callback_query.message.edit_text(profile_text, reply_markup=keyboard)
+            profile_text = PROFILE_TEMPLATE.format(points=points)
+            await callback_query.message.edit_text(profile_text, reply_markup=PROFILE_MENU_KEYBOARD)
 
         elif action == "confessions":
             async with db.acquire() as conn:
@@ -770,19 +1107,19 @@ async def handle_profile_menu(callback_query: types.CallbackQuery):
                 offset = (page - 1) * 5
                 confessions = await conn.fetch("SELECT id, text, status, created_at, photo_file_id FROM confessions WHERE user_id = $1 ORDER BY created_at DESC LIMIT 5 OFFSET $2", user_id, offset)
 
-            response_text = f"<b>📜 Your Confessions (Page {page}/{total_pages})</b>\n\n"
+            response_parts = [f"<b>📜 Your Confessions (Page {page}/{total_pages})</b>\n\n"]
             builder = InlineKeyboardBuilder()
             for conf in confessions:
                 snippet = html.quote(conf['text'][:60]) + ('...' if len(conf['text']) > 60 else '')
                 status_emoji = {"approved": "✅", "pending": "⏳", "rejected": "❌", "deleted": "🗑️"}.get(conf['status'], "❓")
                 photo_indicator = " 📷" if conf['photo_file_id'] else ""
-                response_text += f"<b>ID:</b> #{conf['id']} ({status_emoji} {conf['status'].capitalize()}{photo_indicator})\n<i>\"{snippet}\"</i>\n\n"
+                response_parts.append(f"<b>ID:</b> #{conf['id']} ({status_emoji} {conf['status'].capitalize()}{photo_indicator})\n<i>\"{snippet}\"</i>\n\n")
                 if conf['status'] in ['approved', 'pending']:
-                    builder.row(InlineKeyboardButton(text=f"Request Deletion for #{conf['id']}", callback_data=f"req_del_conf_{conf['id']}"))
+                    builder.row(InlineKeyboardButton(text=f"Request Deletion for #{conf['id']}", callback_data=f"{REQ_DEL_CONF_PREFIX}{conf['id']}"))
 
             nav_keyboard = create_profile_pagination_keyboard("profile_menu_confessions", page, total_pages)
             final_markup = builder.attach(InlineKeyboardBuilder.from_markup(nav_keyboard)).as_markup()
-            await callback_query.message.edit_text(response_text, reply_markup=final_markup)
+            await callback_query.message.edit_text(''.join(response_parts), reply_markup=final_markup)
 
         elif action == "comments":
             async with db.acquire() as conn:
@@ -796,17 +1133,17 @@ async def handle_profile_menu(callback_query: types.CallbackQuery):
                 offset = (page - 1) * 5
                 comments = await conn.fetch("SELECT id, text, sticker_file_id, animation_file_id, confession_id, created_at FROM comments WHERE user_id = $1 ORDER BY created_at DESC LIMIT 5 OFFSET $2", user_id, offset)
 
-            response_text = f"<b>💬 Your Comments (Page {page}/{total_pages})</b>\n\n"
+            response_parts = [f"<b>💬 Your Comments (Page {page}/{total_pages})</b>\n\n"]
             for comm in comments:
                 if comm['text']: snippet = "💬 " + html.quote(comm['text'][:60]) + ('...' if len(comm['text']) > 60 else '')
                 elif comm['sticker_file_id']: snippet = "[Sticker]"
                 elif comm['animation_file_id']: snippet = "[GIF]"
                 else: snippet = "[Unknown Content]"
-                link = f"https://t.me/{bot_info.username}?start=view_{comm['confession_id']}"
-                response_text += f"On Confession <a href='{link}'>#{comm['confession_id']}</a>:\n<i>\"{snippet}\"</i>\n\n"
+                link = await confession_view_link(comm['confession_id'])
+                response_parts.append(f"On Confession <a href='{link}'>#{comm['confession_id']}</a>:\n<i>\"{snippet}\"</i>\n\n")
 
             nav_keyboard = create_profile_pagination_keyboard("profile_menu_comments", page, total_pages)
-            await callback_query.message.edit_text(response_text, reply_markup=nav_keyboard, disable_web_page_preview=True)
+            await callback_query.message.edit_text(''.join(response_parts), reply_markup=nav_keyboard, disable_web_page_preview=True)
     
     # *** FIX: Gracefully handle "message not modified" error ***
     except TelegramBadRequest as e:
@@ -818,11 +1155,11 @@ async def handle_profile_menu(callback_query: types.CallbackQuery):
         await callback_query.answer()
 
 
-@dp.callback_query(F.data.startswith("req_del_conf_"))
+@dp.callback_query(F.data.startswith(REQ_DEL_CONF_PREFIX))
 async def request_deletion_prompt(callback_query: types.CallbackQuery):
-    conf_id = int(callback_query.data.split("_")[-1])
+    conf_id = int(callback_query.data[len(REQ_DEL_CONF_PREFIX):])
     keyboard = InlineKeyboardMarkup(inline_keyboard=[
-        [InlineKeyboardButton(text="✅ Yes, Request Deletion", callback_data=f"confirm_del_conf_{conf_id}")],
+        [InlineKeyboardButton(text="✅ Yes, Request Deletion", callback_data=f"{CONFIRM_DEL_CONF_PREFIX}{conf_id}")],
         [InlineKeyboardButton(text="❌ No, Cancel", callback_data=f"profile_menu_confessions_1")]
     ])
     await callback_query.message.edit_text(
@@ -831,9 +1168,9 @@ async def request_deletion_prompt(callback_query: types.CallbackQuery):
     )
     await callback_query.answer()
 
-@dp.callback_query(F.data.startswith("confirm_del_conf_"))
+@dp.callback_query(F.data.startswith(CONFIRM_DEL_CONF_PREFIX))
 async def confirm_deletion_request(callback_query: types.CallbackQuery):
-    conf_id = int(callback_query.data.split("_")[-1])
+    conf_id = int(callback_query.data[len(CONFIRM_DEL_CONF_PREFIX):])
     user_id = callback_query.from_user.id
 
     async with db.acquire() as conn:
@@ -943,17 +1280,25 @@ async def receive_photo_confession(message: types.Message, state: FSMContext):
     
     await process_confession(message, state, text=text, photo_file_id=photo_file_id)
 
+# Inserts the confession and awards its points in a single statement (atomic, one round trip).
+# FIX: Convert Python list to PostgreSQL array using CAST
+# $1 text, $2 user id, $3 categories, $4 photo file id, $5 points awarded
+CREATE_CONFESSION_SQL = f"""
+    WITH new_confession AS (
+        INSERT INTO confessions (text, user_id, categories, status, photo_file_id)
+        VALUES ($1, $2, $3::text[], 'pending', $4) RETURNING id, user_id
+    ), awarded AS (
+        INSERT INTO user_points (user_id, points) SELECT user_id, $5 FROM new_confession
+        {ADD_USER_POINTS_ON_CONFLICT}
+    )
+    SELECT id FROM new_confession
+"""
+
 async def process_confession(message: types.Message, state: FSMContext, text: str, photo_file_id: Optional[str] = None):
     conf_text = text
     user_id = message.from_user.id
-    state_data = await state.get_data()
-    selected_categories: List[str] = state_data.get("selected_categories", [])
-    
-    if not selected_categories:
-        await message.answer("⚠️ Error: Category info lost. Please start again with /confess.")
-        await state.clear()
-        return
     
+    # Cheap text checks run first so rejected submissions never touch FSM storage
     if len(conf_text) < 10:
         await message.answer("Confession too short (min 10 chars).")
         return
@@ -962,29 +1307,26 @@ async def process_confession(message: types.Message, state: FSMContext, text: st
         await message.answer(f"Confession too long (max 3900 chars).")
         return
     
+    state_data = await state.get_data()
+    selected_categories: List[str] = state_data.get("selected_categories", [])
+    
+    if not selected_categories:
+        await message.answer("⚠️ Error: Category info lost. Please start again with /confess.")
+        await state.clear()
+        return
+    
     try:
         async with db.acquire() as conn:
-            async with conn.transaction():
-                # FIX: Convert Python list to PostgreSQL array using CAST
-                if photo_file_id:
-                    conf_id = await conn.fetchval(
-                        "INSERT INTO confessions (text, user_id, categories, status, photo_file_id) VALUES ($1, $2, $3::text[], 'pending', $4) RETURNING id", 
-                        conf_text, user_id, selected_categories, photo_file_id
-                    )
-                else:
-                    conf_id = await conn.fetchval(
-                        "INSERT INTO confessions (text, user_id, categories, status) VALUES ($1, $2, $3::text[], 'pending') RETURNING id", 
-                        conf_text, user_id, selected_categories
-                    )
-                
-                if not conf_id:
-                    raise Exception("Failed to get confession ID")
-                
-                await update_user_points(conn, user_id, POINTS_PER_CONFESSION)
+            conf_id = await conn.fetchval(CREATE_CONFESSION_SQL, conf_text, user_id, selected_categories, photo_file_id, POINTS_PER_CONFESSION)
+            invalidate_user_points(user_id)
+            
+            if not conf_id:
+                raise Exception("Failed to get confession ID")
         
         category_tags = " ".join([f"#{html.quote(cat)}" for cat in selected_categories])
         
-        # Send to admin based on confession type
+        # Send to admin based on confession type. The user is acknowledged only after the review message is out;
+        # if that send fails it raises into the error reply below instead of reporting a successful submission.
         if photo_file_id:
             # Photo confession to admin
             admin_caption = (
@@ -995,10 +1337,7 @@ async def process_confession(message: types.Message, state: FSMContext, text: st
                 f"<b>Caption:</b>\n{html.quote(conf_text)}"
             )
             
-            kbd = InlineKeyboardMarkup(inline_keyboard=[
-                [InlineKeyboardButton(text="✅ Approve", callback_data=f"approve_{conf_id}")],
-                [InlineKeyboardButton(text="❌ Reject", callback_data=f"reject_{conf_id}")]
-            ])
+            kbd = build_review_keyboard(conf_id)
             
             await bot.send_photo(
                 chat_id=ADMIN_ID,
@@ -1023,10 +1362,7 @@ async def process_confession(message: types.Message, state: FSMContext, text: st
                 f"<b>Text:</b>\n{html.quote(conf_text)}"
             )
             
-            kbd = InlineKeyboardMarkup(inline_keyboard=[
-                [InlineKeyboardButton(text="✅ Approve", callback_data=f"approve_{conf_id}")],
-                [InlineKeyboardButton(text="❌ Reject", callback_data=f"reject_{conf_id}")]
-            ])
+            kbd = build_review_keyboard(conf_id)
             
             await bot.send_message(ADMIN_ID, admin_msg_text, reply_markup=kbd)
             await message.answer("✅ Your confession has been submitted and is pending review.")
@@ -1041,36 +1377,23 @@ async def process_confession(message: types.Message, state: FSMContext, text: st
         await state.clear()
 
 # --- Admin Action Handlers ---
-@dp.callback_query(F.data.startswith("approve_"))
-async def handle_approve_confession(callback_query: types.CallbackQuery, state: FSMContext):
+async def handle_approve_confession(callback_query: types.CallbackQuery, state: FSMContext, conf_id: int):
     """Handle approve button for confessions"""
-    if callback_query.from_user.id != ADMIN_ID:
-        await callback_query.answer("Unauthorized.", show_alert=True)
-        return
+    conf = await db.fetchrow(
+        "SELECT id, text, user_id, categories, status, photo_file_id FROM confessions WHERE id = $1", 
+        conf_id
+    )
     
-    try:
-        # Get confession ID from callback data (approve_123)
-        conf_id = int(callback_query.data.split("_")[1])
-    except (IndexError, ValueError):
-        await callback_query.answer("Invalid confession ID.", show_alert=True)
+    if not conf:
+        await callback_query.answer("Confession not found.", show_alert=True)
         return
     
-    async with db.acquire() as conn:
-        conf = await conn.fetchrow(
-            "SELECT id, text, user_id, categories, status, photo_file_id FROM confessions WHERE id = $1", 
-            conf_id
-        )
-        
-        if not conf:
-            await callback_query.answer("Confession not found.", show_alert=True)
-            return
-        
-        if conf['status'] != 'pending':
-            await callback_query.answer(f"Already '{conf['status']}'.", show_alert=True)
-            return
+    if conf['status'] != 'pending':
+        await callback_query.answer(f"Already '{conf['status']}'.", show_alert=True)
+        return
     
     try:
-        link = f"https://t.me/{bot_info.username}?start=view_{conf['id']}"
+        link = await confession_view_link(conf['id'])
         category_tags = " ".join([f"#{html.quote(cat)}" for cat in conf['categories'] or []])
         
         # Check if it's a photo confession
@@ -1097,14 +1420,13 @@ async def handle_approve_confession(callback_query: types.CallbackQuery, state:
             msg = await bot.send_message(CHANNEL_ID, channel_post_text, reply_markup=channel_kbd)
         
         # Update database
-        async with db.acquire() as conn:
-            await conn.execute(
-                "UPDATE confessions SET status = 'approved', message_id = $1 WHERE id = $2",
-                msg.message_id, conf_id
-            )
+        await db.execute(
+            "UPDATE confessions SET status = 'approved', message_id = $1 WHERE id = $2",
+            msg.message_id, conf_id
+        )
         
         # Notify user
-        await safe_send_message(conf['user_id'], f"✅ Your confession (#{conf_id}) has been approved!")
+        run_in_background(safe_send_message(conf['user_id'], f"✅ Your confession (#{conf_id}) has been approved!"))
         
         # Update admin message
         await callback_query.message.edit_text(
@@ -1119,20 +1441,8 @@ async def handle_approve_confession(callback_query: types.CallbackQuery, state:
         await callback_query.answer(f"Error: {str(e)[:100]}", show_alert=True)
 
 
-@dp.callback_query(F.data.startswith("reject_"))
-async def handle_reject_confession(callback_query: types.CallbackQuery, state: FSMContext):
+async def handle_reject_confession(callback_query: types.CallbackQuery, state: FSMContext, conf_id: int):
     """Handle reject button for confessions - starts rejection process"""
-    if callback_query.from_user.id != ADMIN_ID:
-        await callback_query.answer("Unauthorized.", show_alert=True)
-        return
-    
-    try:
-        # Get confession ID from callback data (reject_123)
-        conf_id = int(callback_query.data.split("_")[1])
-    except (IndexError, ValueError):
-        await callback_query.answer("Invalid confession ID.", show_alert=True)
-        return
-    
     # Start rejection process
     await state.update_data(
         rejecting_conf_id=conf_id,
@@ -1142,22 +1452,25 @@ async def handle_reject_confession(callback_query: types.CallbackQuery, state: F
     
     await state.set_state(AdminActions.waiting_for_rejection_reason)
     
-    reason_keyboard = ReplyKeyboardMarkup(
-        keyboard=[
-            [KeyboardButton(text="/skip")],
-            [KeyboardButton(text="/cancel")]
-        ],
-        resize_keyboard=True,
-        one_time_keyboard=True
-    )
-    
     await callback_query.answer("❓ Provide rejection reason")
     await bot.send_message(
         callback_query.from_user.id,
         f"Reason for rejecting Confession #{conf_id}?\nUse /skip or /cancel.",
-        reply_markup=reason_keyboard
+        reply_markup=REJECTION_REASON_KEYBOARD
     )
 
+CONFESSION_REVIEW_ACTIONS = {"approve": handle_approve_confession, "reject": handle_reject_confession}
+
+# Single anchored filter for both review buttons; unlike a bare "approve_" prefix it can't swallow approve_contact_
+@dp.callback_query(F.data.regexp(r"^(approve|reject)_\d+$"))
+async def handle_confession_review(callback_query: types.CallbackQuery, state: FSMContext):
+    """Dispatches approve_<id> / reject_<id> review buttons to their action handler"""
+    if callback_query.from_user.id != ADMIN_ID:
+        await callback_query.answer("Unauthorized.", show_alert=True)
+        return
+    action, _, conf_id = callback_query.data.partition("_")
+    await CONFESSION_REVIEW_ACTIONS[action](callback_query, state, int(conf_id))
+
 @dp.message(AdminActions.waiting_for_rejection_reason, F.text)
 async def receive_rejection_reason(message: types.Message, state: FSMContext):
     data = await state.get_data()
@@ -1167,23 +1480,22 @@ async def receive_rejection_reason(message: types.Message, state: FSMContext):
 
     if not conf_id: await message.answer("Error: Context lost."); await state.clear(); return
     reason, reason_text_for_user = None, "Your confession was rejected."
-    if message.text.startswith("/skip"): await message.answer("Skipping reason.", reply_markup=ReplyKeyboardRemove())
-    elif message.text.startswith("/cancel"): await message.answer("Rejection cancelled.", reply_markup=ReplyKeyboardRemove()); await state.clear(); return
+    if message.text.startswith("/skip"): await message.answer("Skipping reason.", reply_markup=REMOVE_REPLY_KEYBOARD)
+    elif message.text.startswith("/cancel"): await message.answer("Rejection cancelled.", reply_markup=REMOVE_REPLY_KEYBOARD); await state.clear(); return
     else: reason = message.text.strip(); reason_text_for_user = f"Your confession was rejected for the following reason:\n<i>{html.quote(reason)}</i>"
     
-    async with db.acquire() as conn:
-        conf_data = await conn.fetchrow("SELECT user_id, categories FROM confessions WHERE id = $1 AND status = 'pending'", conf_id)
-        if not conf_data: await message.answer("Error: Confession no longer pending.", reply_markup=ReplyKeyboardRemove()); await state.clear(); return
-        await conn.execute("UPDATE confessions SET status = 'rejected', rejection_reason = $1 WHERE id = $2", reason, conf_id)
-        category_tags = " ".join([f"#{html.quote(cat)}" for cat in conf_data['categories'] or []])
-        await safe_send_message(conf_data['user_id'], f"❌ {reason_text_for_user}\n(Confession ID: #{conf_id}, Categories: {category_tags})")
+    # The status guard and the update are one statement, so a confession can't be rejected twice concurrently
+    conf_data = await db.fetchrow("UPDATE confessions SET status = 'rejected', rejection_reason = $1 WHERE id = $2 AND status = 'pending' RETURNING user_id, categories", reason, conf_id)
+    if not conf_data: await message.answer("Error: Confession no longer pending.", reply_markup=REMOVE_REPLY_KEYBOARD); await state.clear(); return
+    category_tags = " ".join([f"#{html.quote(cat)}" for cat in conf_data['categories'] or []])
+    run_in_background(safe_send_message(conf_data['user_id'], f"❌ {reason_text_for_user}\n(Confession ID: #{conf_id}, Categories: {category_tags})"))
+    
+    try:
+        await bot.edit_message_text(original_admin_text + f"\n\n-- Rejected --\nReason: {html.quote(reason or 'Skipped')}", chat_id=ADMIN_ID, message_id=admin_review_message_id, reply_markup=None)
+    except Exception as e:
+        logging.error(f"Could not edit admin review message {admin_review_message_id} for rejection: {e}")
         
-        try:
-            await bot.edit_message_text(original_admin_text + f"\n\n-- Rejected --\nReason: {html.quote(reason or 'Skipped')}", chat_id=ADMIN_ID, message_id=admin_review_message_id, reply_markup=None)
-        except Exception as e:
-            logging.error(f"Could not edit admin review message {admin_review_message_id} for rejection: {e}")
-            
-        await message.answer(f"Confession #{conf_id} rejected.", reply_markup=ReplyKeyboardRemove())
+    await message.answer(f"Confession #{conf_id} rejected.", reply_markup=REMOVE_REPLY_KEYBOARD)
     await state.clear()
 
 # --- Admin Deletion Request Handlers ---
@@ -1192,9 +1504,8 @@ async def admin_handle_deletion_request(callback_query: types.CallbackQuery):
     if callback_query.from_user.id != ADMIN_ID:
         await callback_query.answer("Unauthorized.", show_alert=True); return
 
-    parts = callback_query.data.split("_")
-    action = parts[1]
-    conf_id = int(parts[-1])
+    _, action, _, conf_id = callback_query.data.split("_", 3)
+    conf_id = int(conf_id)
     final_status = ""
 
     async with db.acquire() as conn:
@@ -1204,20 +1515,20 @@ async def admin_handle_deletion_request(callback_query: types.CallbackQuery):
                 await callback_query.answer("Request not found or already processed.", show_alert=True); return
 
             if action == "approve":
-                conf_to_delete = await conn.fetchrow("SELECT message_id, user_id FROM confessions WHERE id = $1", conf_id)
+                # DELETE ... RETURNING hands back the channel message id in the same round trip as the delete
+                conf_to_delete = await conn.fetchrow("DELETE FROM confessions WHERE id = $1 RETURNING message_id", conf_id)
                 if conf_to_delete:
-                    await conn.execute("DELETE FROM confessions WHERE id = $1", conf_id)
                     try:
                         if conf_to_delete['message_id']:
                             await bot.delete_message(chat_id=CHANNEL_ID, message_id=conf_to_delete['message_id'])
                     except Exception as e:
-                        logging.warning(f"Could not delete channel message {conf_to_delete.get('message_id')} for deleted conf {conf_id}: {e}")
+                        logging.warning(f"Could not delete channel message {conf_to_delete['message_id']} for deleted conf {conf_id}: {e}")
                 await conn.execute("UPDATE deletion_requests SET status = 'approved', reviewed_at = CURRENT_TIMESTAMP WHERE id = $1", req_data['id'])
-                await safe_send_message(req_data['user_id'], f"✅ Your request to delete Confession #{conf_id} has been approved. It has been permanently removed.")
+                run_in_background(safe_send_message(req_data['user_id'], f"✅ Your request to delete Confession #{conf_id} has been approved. It has been permanently removed."))
                 final_status = "Approved & Deleted"
             else: # Reject
                 await conn.execute("UPDATE deletion_requests SET status = 'rejected', reviewed_at = CURRENT_TIMESTAMP WHERE id = $1", req_data['id'])
-                await safe_send_message(req_data['user_id'], f"❌ Your request to delete Confession #{conf_id} was rejected by the admin.")
+                run_in_background(safe_send_message(req_data['user_id'], f"❌ Your request to delete Confession #{conf_id} was rejected by the admin."))
                 final_status = "Rejected"
 
     await callback_query.message.edit_text(callback_query.message.html_text + f"\n\n-- Deletion Request: {final_status} --", reply_markup=None)
@@ -1263,19 +1574,19 @@ async def apply_block(message: types.Message, user_id: int, reason: Optional[str
         except (ValueError, IndexError):
             return await message.reply("Invalid duration format. Use 'd' for days or 'w' for weeks (e.g., 7d, 2w).")
 
-    async with db.acquire() as conn:
-        await conn.execute("""
-            INSERT INTO user_status (user_id, is_blocked, blocked_until, block_reason) 
-            VALUES ($1, TRUE, $2, $3)
-            ON CONFLICT (user_id) DO UPDATE SET
-            is_blocked = TRUE, blocked_until = $2, block_reason = $3
-        """, user_id, blocked_until, reason)
+    await db.execute("""
+        INSERT INTO user_status (user_id, is_blocked, blocked_until, block_reason) 
+        VALUES ($1, TRUE, $2, $3)
+        ON CONFLICT (user_id) DO UPDATE SET
+        is_blocked = TRUE, blocked_until = $2, block_reason = $3
+    """, user_id, blocked_until, reason)
+    invalidate_user_status(user_id)
     
     expiry_info = "permanently" if is_permanent else f"until {blocked_until.strftime('%Y-%m-%d %H:%M %Z')}"
     reason_info = f"\nReason: <i>{html.quote(reason)}</i>" if reason else ""
     notification_text = f"❌ <b>You have been blocked from using this bot {expiry_info}.</b>{reason_info}"
     
-    await safe_send_message(user_id, notification_text)
+    run_in_background(safe_send_message(user_id, notification_text))
     await message.reply(f"✅ User ID <code>{user_id}</code> has been blocked {expiry_info}.")
 
 @dp.message(Command("block"))
@@ -1313,39 +1624,51 @@ async def admin_unblock_user(message: types.Message, command: CommandObject):
     try: target_user_id = int(command.args.strip())
     except ValueError: return await message.reply("Invalid User ID.")
     
-    async with db.acquire() as conn:
-        result = await conn.execute("""
-            UPDATE user_status SET is_blocked = FALSE, blocked_until = NULL, block_reason = NULL 
-            WHERE user_id = $1 AND is_blocked = TRUE
-        """, target_user_id)
+    result = await db.execute("""
+        UPDATE user_status SET is_blocked = FALSE, blocked_until = NULL, block_reason = NULL 
+        WHERE user_id = $1 AND is_blocked = TRUE
+    """, target_user_id)
+    invalidate_user_status(target_user_id)
     
     if result == "UPDATE 1":
-        await safe_send_message(target_user_id, "✅ You have been unblocked by the admin and can now use the bot again.")
+        run_in_background(safe_send_message(target_user_id, "✅ You have been unblocked by the admin and can now use the bot again."))
         await message.reply(f"✅ User ID <code>{target_user_id}</code> has been unblocked.")
     else:
         await message.reply(f"ℹ️ User ID <code>{target_user_id}</code> was not blocked.")
 
 
 # --- Commenting Flow Handlers ---
-@dp.callback_query(F.data.startswith("browse_"))
+@dp.callback_query(F.data.startswith(BROWSE_PREFIX))
 async def browse_comments_action(callback_query: types.CallbackQuery):
-    conf_id = int(callback_query.data.split("_", 1)[1])
+    conf_id = int(callback_query.data[len(BROWSE_PREFIX):])
     await callback_query.answer("Loading comments...")
     await show_comments_for_confession(callback_query.from_user.id, conf_id, callback_query.message)
 
-@dp.callback_query(F.data.startswith("add_"))
+@dp.callback_query(F.data.startswith(ADD_COMMENT_PREFIX))
 async def add_comment_prompt(callback_query: types.CallbackQuery, state: FSMContext):
-    conf_id = int(callback_query.data.split("_", 1)[1])
+    conf_id = int(callback_query.data[len(ADD_COMMENT_PREFIX):])
     await state.update_data(confession_id=conf_id, parent_comment_id=None)
     await state.set_state(CommentForm.waiting_for_comment)
     await safe_send_message(callback_query.from_user.id, f"📝 You are adding a comment to Confession #{conf_id}.\nPlease send your comment as text, a sticker, or a GIF, or /cancel.")
     await callback_query.answer()
 
-@dp.callback_query(F.data.startswith("comments_page_"))
+@dp.callback_query(F.data.startswith(("comments_next_", "comments_prev_")))
 async def comments_page_callback(callback_query: types.CallbackQuery):
-    _, _, conf_id, page = callback_query.data.split("_"); conf_id, page = int(conf_id), int(page)
+    _, direction, conf_id, cursor_id, offset = callback_query.data.split("_", 4); conf_id, cursor_id, offset = int(conf_id), int(cursor_id), int(offset)
     await callback_query.answer("Loading page...")
-    await show_comments_for_confession(callback_query.from_user.id, conf_id, callback_query.message, page=page)
+    if direction == "next":
+        await show_comments_for_confession(callback_query.from_user.id, conf_id, callback_query.message, after_id=cursor_id, offset=offset)
+    else:
+        await show_comments_for_confession(callback_query.from_user.id, conf_id, callback_query.message, before_id=cursor_id, offset=offset)
+
+# Buttons posted before cursor pagination carry comments_page_<conf_id>_<page>. A cursor can't address a page
+# number, so they open the first page instead of leaving the user with an unanswered callback.
+@dp.callback_query(F.data.startswith("comments_page_"))
+async def legacy_comments_page_callback(callback_query: types.CallbackQuery):
+    await callback_query.answer("Loading page...")
+    try: conf_id = int(callback_query.data.split("_")[2])
+    except (IndexError, ValueError): return
+    await show_comments_for_confession(callback_query.from_user.id, conf_id, callback_query.message)
 
 @dp.message(CommentForm.waiting_for_comment, F.text | F.sticker | F.animation)
 async def receive_comment(message: types.Message, state: FSMContext):
@@ -1365,9 +1688,9 @@ async def receive_comment(message: types.Message, state: FSMContext):
         await message.answer("💬 Your comment has been added!");
         await update_channel_post_button(conf_id)
         if conf_owner_id and conf_owner_id != user_id:
-            link = f"https://t.me/{bot_info.username}?start=view_{conf_id}"
+            link = await confession_view_link(conf_id)
             preview = html.quote(comm_text[:150]) if comm_text else f"[{log_type}]"
-            await safe_send_message(conf_owner_id, f"💬 A new comment has been posted on your Confession #{conf_id}.\n\n<i>{preview}...</i>\n\n<a href='{link}'>Click here to view.</a>", disable_web_page_preview=True)
+            run_in_background(safe_send_message(conf_owner_id, f"💬 A new comment has been posted on your Confession #{conf_id}.\n\n<i>{preview}...</i>\n\n<a href='{link}'>Click here to view.</a>", disable_web_page_preview=True))
         await show_comments_for_confession(user_id, conf_id)
     except Exception as e:
         logging.error(f"Error saving {log_type} comment for Conf {conf_id} by {user_id}: {e}", exc_info=True)
@@ -1376,11 +1699,10 @@ async def receive_comment(message: types.Message, state: FSMContext):
 
 
 # --- MODIFIED: Reworked Reply Flow for Force Reply ---
-@dp.callback_query(F.data.startswith("reply_"))
+@dp.callback_query(F.data.startswith(REPLY_PREFIX))
 async def reply_comment_prompt(callback_query: types.CallbackQuery, state: FSMContext):
-    parent_id = int(callback_query.data.split("_", 1)[1])
-    async with db.acquire() as conn:
-        comm_data = await conn.fetchrow("SELECT confession_id, text, sticker_file_id, animation_file_id, user_id FROM comments WHERE id = $1", parent_id)
+    parent_id = int(callback_query.data[len(REPLY_PREFIX):])
+    comm_data = await db.fetchrow("SELECT confession_id, text, sticker_file_id, animation_file_id, user_id FROM comments WHERE id = $1", parent_id)
     if not comm_data: await callback_query.answer("Comment no longer exists.", show_alert=True); return
     if callback_query.from_user.id == comm_data['user_id']: await callback_query.answer("You cannot reply to yourself.", show_alert=True); return
 
@@ -1415,6 +1737,18 @@ async def reply_comment_prompt(callback_query: types.CallbackQuery, state: FSMCo
         await state.clear()
 
 # --- MODIFIED: Handler now expects a native reply and validates it ---
+# $1 parent comment id, $2 replying user, $3 text, $4 sticker, $5 animation
+INSERT_REPLY_SQL = """
+    WITH parent AS (
+        SELECT id, user_id, confession_id FROM comments WHERE id = $1
+    ), inserted AS (
+        INSERT INTO comments (confession_id, user_id, text, sticker_file_id, animation_file_id, parent_comment_id)
+        SELECT confession_id, $2::bigint, $3::text, $4::text, $5::text, id FROM parent
+    )
+    SELECT parent.user_id AS parent_uid, co.user_id AS conf_owner_id
+    FROM parent JOIN confessions co ON co.id = parent.confession_id
+"""
+
 @dp.message(CommentForm.waiting_for_reply, F.reply_to_message)
 async def receive_reply(message: types.Message, state: FSMContext):
     user_id = message.from_user.id
@@ -1438,25 +1772,18 @@ async def receive_reply(message: types.Message, state: FSMContext):
     
     # ... (database insertion and notification logic remains largely the same) ...
     try:
-        async with db.acquire() as conn:
-            async with conn.transaction():
-                parent_data = await conn.fetchrow("SELECT user_id FROM comments WHERE id = $1", parent_id)
-                if not parent_data: await message.answer("⚠️ The comment you were replying to has been deleted."); await state.clear(); return
-                conf_data = await conn.fetchrow("SELECT user_id FROM confessions WHERE id = $1", conf_id)
-                
-                await conn.execute(
-                    "INSERT INTO comments (confession_id, user_id, text, sticker_file_id, animation_file_id, parent_comment_id) VALUES ($1, $2, $3, $4, $5, $6)",
-                    conf_id, user_id, reply_text, sticker_id, animation_id, parent_id
-                )
+        # One statement checks the parent still exists, inserts the reply and returns who to notify
+        reply_data = await db.fetchrow(INSERT_REPLY_SQL, parent_id, user_id, reply_text, sticker_id, animation_id)
+        if not reply_data: await message.answer("⚠️ The comment you were replying to has been deleted."); return
         
-        await message.answer("↪️ Your reply has been sent!", reply_markup=ReplyKeyboardRemove())
+        await message.answer("↪️ Your reply has been sent!", reply_markup=REMOVE_REPLY_KEYBOARD)
         await update_channel_post_button(conf_id)
         
-        if parent_data['user_id'] != user_id:
-            link = f"https://t.me/{bot_info.username}?start=view_{conf_id}"
+        if reply_data['parent_uid'] != user_id:
+            link = await confession_view_link(conf_id)
             preview = html.quote(reply_text[:150]) if reply_text else f"[{log_type.replace(' Reply', '')}]"
-            tag = "(Author)" if user_id == conf_data['user_id'] else "Anonymous"
-            await safe_send_message(parent_data['user_id'], f"↪️ Someone ({tag}) replied to your comment on Confession #{conf_id}.\n\n<i>{preview}...</i>\n\n<a href='{link}'>Click here to view.</a>", disable_web_page_preview=True)
+            tag = "(Author)" if user_id == reply_data['conf_owner_id'] else "Anonymous"
+            run_in_background(safe_send_message(reply_data['parent_uid'], f"↪️ Someone ({tag}) replied to your comment on Confession #{conf_id}.\n\n<i>{preview}...</i>\n\n<a href='{link}'>Click here to view.</a>", disable_web_page_preview=True))
         
         # Finally, show the updated comments view to the user
         await show_comments_for_confession(user_id, conf_id)
@@ -1468,52 +1795,97 @@ async def receive_reply(message: types.Message, state: FSMContext):
 
 
 # --- Reaction Handling ---
-@dp.callback_query(F.data.startswith("react_"))
-async def handle_reaction(callback_query: types.CallbackQuery):
-    _, r_type, comm_id = callback_query.data.split("_"); comm_id = int(comm_id); user_id = callback_query.from_user.id
-    point_delta, alert = 0, ""
-    async with db.acquire() as conn:
-        async with conn.transaction():
-            info = await conn.fetchrow("SELECT c.user_id as comm_uid, co.user_id as conf_owner_id FROM comments c JOIN confessions co ON c.confession_id = co.id WHERE c.id = $1", comm_id)
-            if not info: await callback_query.answer("Comment not found.", show_alert=True); return
-            if info['comm_uid'] == user_id: await callback_query.answer("You cannot react to your own comment.", show_alert=True); return
-            existing = await conn.fetchval("SELECT reaction_type FROM reactions WHERE comment_id = $1 AND user_id = $2", comm_id, user_id)
-            if existing:
-                if existing == r_type: # Remove
-                    await conn.execute("DELETE FROM reactions WHERE comment_id = $1 AND user_id = $2", comm_id, user_id)
-                    point_delta = -POINTS_PER_LIKE_RECEIVED if r_type == 'like' else -POINTS_PER_DISLIKE_RECEIVED
-                    alert = f"{r_type.capitalize()} removed"
-                else: # Change
-                    await conn.execute("UPDATE reactions SET reaction_type = $1 WHERE comment_id = $2 AND user_id = $3", r_type, comm_id, user_id)
-                    point_delta = 2 * POINTS_PER_LIKE_RECEIVED if r_type == 'like' else 2 * POINTS_PER_DISLIKE_RECEIVED
-                    alert = f"Reaction changed to {r_type}"
-            else: # Add new
-                await conn.execute("INSERT INTO reactions (comment_id, user_id, reaction_type) VALUES ($1, $2, $3)", comm_id, user_id, r_type)
-                point_delta = POINTS_PER_LIKE_RECEIVED if r_type == 'like' else POINTS_PER_DISLIKE_RECEIVED
-                alert = f"{r_type.capitalize()} added"
-            if point_delta != 0: await update_user_points(conn, info['comm_uid'], point_delta)
-    kbd = await build_comment_keyboard(comm_id, info['comm_uid'], user_id, info['conf_owner_id'])
+REACTION_POINTS = {'like': POINTS_PER_LIKE_RECEIVED, 'dislike': POINTS_PER_DISLIKE_RECEIVED}
+OPPOSITE_REACTION = {'like': 'dislike', 'dislike': 'like'}
+
+# Toggles a reaction in one statement: the same type again removes it, a different type switches it,
+# otherwise it is added. The commenter's points move by the delta of the row change that actually happened
+# (removed/inserted/switched as reported by DELETE and the upsert), so a concurrent duplicate tap that finds
+# its change already applied writes nothing and awards nothing.
+# Nothing is written when the comment is missing or belongs to the reacting user.
+# $1 comment id, $2 reacting user, $3 reaction type, $4 points for that type, $5 points for the other type
+REACTION_TOGGLE_SQL = f"""
+    WITH target AS (
+        SELECT c.user_id AS comm_uid, co.user_id AS conf_owner_id, c.likes, c.dislikes
+        FROM comments c JOIN confessions co ON c.confession_id = co.id
+        WHERE c.id = $1
+    ), existing AS (
+        SELECT reaction_type FROM reactions WHERE comment_id = $1 AND user_id = $2
+    ), removed AS (
+        DELETE FROM reactions
+        WHERE comment_id = $1 AND user_id = $2 AND reaction_type = $3
+          AND EXISTS (SELECT 1 FROM target WHERE comm_uid <> $2)
+        RETURNING 1
+    ), upserted AS (
+        INSERT INTO reactions (comment_id, user_id, reaction_type)
+        SELECT $1, $2, $3 FROM target
+        WHERE comm_uid <> $2 AND NOT EXISTS (SELECT 1 FROM existing WHERE reaction_type = $3)
+        ON CONFLICT (comment_id, user_id) DO UPDATE SET reaction_type = EXCLUDED.reaction_type
+        WHERE reactions.reaction_type IS DISTINCT FROM EXCLUDED.reaction_type
+        RETURNING (xmax = 0) AS inserted
+    ), change AS (
+        SELECT 'removed' AS action, -$4::int AS delta FROM removed
+        UNION ALL
+        SELECT CASE WHEN inserted THEN 'added' ELSE 'switched' END,
+               CASE WHEN inserted THEN $4::int ELSE $4::int - $5::int END
+        FROM upserted
+    ), awarded AS (
+        INSERT INTO user_points (user_id, points)
+        SELECT t.comm_uid, SUM(c.delta) FROM target t CROSS JOIN change c GROUP BY t.comm_uid
+        {ADD_USER_POINTS_ON_CONFLICT}
+    )
+    SELECT t.comm_uid, t.conf_owner_id, t.likes, t.dislikes, (SELECT action FROM change LIMIT 1) AS action
+    FROM target t
+"""
+
+async def toggle_reaction(comm_id: int, user_id: int, r_type: str) -> Optional[asyncpg.Record]:
+    """Applies a reaction tap; returns the comment's owner ids, its pre-toggle counts and the change made (None if nothing changed)."""
+    other = OPPOSITE_REACTION[r_type]
+    row = await db.fetchrow(REACTION_TOGGLE_SQL, comm_id, user_id, r_type, REACTION_POINTS[r_type], REACTION_POINTS[other])
+    if row and row['action']: invalidate_user_points(row['comm_uid'])
+    return row
+
+@dp.callback_query(ReactionCallback.filter(F.type.in_(REACTION_TYPES)))
+async def handle_reaction(callback_query: types.CallbackQuery, callback_data: ReactionCallback):
+    r_type, comm_id, user_id = callback_data.type, callback_data.comment_id, callback_query.from_user.id
+    row = await toggle_reaction(comm_id, user_id, r_type)
+    if not row: await callback_query.answer("Comment not found.", show_alert=True); return
+    if row['comm_uid'] == user_id: await callback_query.answer("You cannot react to your own comment.", show_alert=True); return
+    # A concurrent tap already applied this change; the counts read here would be stale, so leave the keyboard alone
+    if not row['action']: await callback_query.answer(); return
+
+    # Counts in the row predate this toggle (the trigger's update isn't visible to the same statement), so apply it here
+    counts = {'like': row['likes'], 'dislike': row['dislikes']}
+    action = row['action']
+    if action == 'removed':
+        counts[r_type] -= 1; alert = f"{r_type.capitalize()} removed"
+    elif action == 'switched':
+        counts[r_type] += 1; counts[OPPOSITE_REACTION[r_type]] -= 1; alert = f"Reaction changed to {r_type}"
+    else:
+        counts[r_type] += 1; alert = f"{r_type.capitalize()} added"
+
+    # Only the keyboard is re-sent with the fresh totals
+    kbd = build_comment_keyboard(comm_id, row['comm_uid'], user_id, row['conf_owner_id'], counts['like'], counts['dislike'])
     try: await callback_query.message.edit_reply_markup(reply_markup=kbd); await callback_query.answer(alert)
     except TelegramBadRequest as e:
         if "message is not modified" not in str(e).lower(): logging.warning(f"Could not edit markup for react on comment {comm_id}: {e}")
         else: await callback_query.answer(alert)
 
 # --- Report Comment Handlers ---
-@dp.callback_query(F.data.startswith("report_confirm_"))
+@dp.callback_query(F.data.startswith(REPORT_CONFIRM_PREFIX))
 async def report_confirm_callback(callback_query: types.CallbackQuery):
-    comment_id = int(callback_query.data.split("_")[-1]); reporter_user_id = callback_query.from_user.id
-    async with db.acquire() as conn:
-        comment_data = await conn.fetchrow("SELECT text, user_id FROM comments WHERE id = $1", comment_id)
-        if not comment_data: await callback_query.answer("Comment deleted.", show_alert=True); return
-        if comment_data['user_id'] == reporter_user_id: await callback_query.answer("You cannot report yourself.", show_alert=True); return
+    comment_id = int(callback_query.data[len(REPORT_CONFIRM_PREFIX):]); reporter_user_id = callback_query.from_user.id
+    comment_data = await db.fetchrow("SELECT text, user_id FROM comments WHERE id = $1", comment_id)
+    if not comment_data: await callback_query.answer("Comment deleted.", show_alert=True); return
+    if comment_data['user_id'] == reporter_user_id: await callback_query.answer("You cannot report yourself.", show_alert=True); return
     snippet = html.quote(comment_data['text'][:100]) if comment_data['text'] else "[Sticker/GIF]"
     confirm_text = f"Are you sure you want to report this comment for admin review?\n\n<i>\"{snippet}...\"</i>"
-    kbd = InlineKeyboardMarkup(inline_keyboard=[[InlineKeyboardButton(text="✅ Yes, Report", callback_data=f"report_execute_{comment_id}"), InlineKeyboardButton(text="❌ No, Cancel", callback_data="report_cancel")]])
+    kbd = InlineKeyboardMarkup(inline_keyboard=[[InlineKeyboardButton(text="✅ Yes, Report", callback_data=f"{REPORT_EXECUTE_PREFIX}{comment_id}"), InlineKeyboardButton(text="❌ No, Cancel", callback_data="report_cancel")]])
     await safe_send_message(reporter_user_id, confirm_text, reply_markup=kbd); await callback_query.answer()
 
-@dp.callback_query(F.data.startswith("report_execute_"))
+@dp.callback_query(F.data.startswith(REPORT_EXECUTE_PREFIX))
 async def report_execute_callback(callback_query: types.CallbackQuery):
-    comment_id = int(callback_query.data.split("_")[-1]); reporter_user_id = callback_query.from_user.id
+    comment_id = int(callback_query.data[len(REPORT_EXECUTE_PREFIX):]); reporter_user_id = callback_query.from_user.id
     try:
         async with db.acquire() as conn:
             async with conn.transaction():
@@ -1523,7 +1895,7 @@ async def report_execute_callback(callback_query: types.CallbackQuery):
                 if reported_user_id == reporter_user_id: await callback_query.message.edit_text("Action cancelled: Cannot report own comment."); return
                 await conn.execute("INSERT INTO reports (comment_id, reporter_user_id, reported_user_id) VALUES ($1, $2, $3) ON CONFLICT (comment_id, reporter_user_id) DO NOTHING", comment_id, reporter_user_id, reported_user_id)
         snippet = html.quote(comment_data['text'][:200]) if comment_data['text'] else f"[Sticker/GIF: <code>{comment_data.get('sticker_file_id') or comment_data.get('animation_file_id')}</code>]"
-        conf_link = f"https://t.me/{bot_info.username}?start=view_{comment_data['confession_id']}"
+        conf_link = await confession_view_link(comment_data['confession_id'])
         admin_notification = (f"⚠️ <b>New Comment Report</b> ⚠️\n\n<b>Confession:</b> <a href='{conf_link}'>#{comment_data['confession_id']}</a>\n"
                               f"<b>Comment ID:</b> <code>{comment_id}</code>\n<b>Content:</b>\n<i>{snippet}</i>\n\n"
                               f"<b>Reported User:</b> <code>{reported_user_id}</code>\n<b>Reporter:</b> <code>{reporter_user_id}</code>")
@@ -1540,9 +1912,9 @@ async def report_cancel_callback(callback_query: types.CallbackQuery):
 
 
 # --- Rebuilt Contact Request Flow ---
-@dp.callback_query(F.data.startswith("req_contact_"))
+@dp.callback_query(F.data.startswith(REQ_CONTACT_PREFIX))
 async def handle_request_contact(callback_query: types.CallbackQuery):
-    comm_id = int(callback_query.data.split("_")[-1]); requester_uid = callback_query.from_user.id
+    comm_id = int(callback_query.data[len(REQ_CONTACT_PREFIX):]); requester_uid = callback_query.from_user.id
     async with db.acquire() as conn:
         async with conn.transaction():
             comm_data = await conn.fetchrow("SELECT c.user_id as comm_uid, c.text, c.sticker_file_id, c.animation_file_id, co.id as conf_id, co.user_id as conf_owner_id FROM comments c JOIN confessions co ON c.confession_id = co.id WHERE c.id = $1", comm_id)
@@ -1608,7 +1980,7 @@ async def handle_contact_response(callback_query: types.CallbackQuery):
                 notification_to_author = f"❌ The commenter for Confession #{conf_id} has declined your contact request."
                 await callback_query.message.edit_text(callback_query.message.html_text + "\n\n-- Denied. The author has been notified. --", reply_markup=None)
             
-            await safe_send_message(author_uid, notification_to_author)
+            run_in_background(safe_send_message(author_uid, notification_to_author))
             await callback_query.answer("Response recorded.")
 
 # --- Fallback Handler ---
@@ -1630,30 +2002,14 @@ async def main():
         dp.callback_query.middleware(BlockUserMiddleware())
 
         # Set bot commands
-        commands = [
-            types.BotCommand(command="start", description="Start/View confession"),
-            types.BotCommand(command="confess", description="Submit anonymous confession (text or photo)"),
-            types.BotCommand(command="profile", description="View your profile and history"),
-            types.BotCommand(command="help", description="Show help and commands"),
-            types.BotCommand(command="rules", description="View the bot's rules"),
-            types.BotCommand(command="privacy", description="View privacy information"),
-            types.BotCommand(command="cancel", description="Cancel current action"),
-        ]
-        admin_commands = commands + [
-            types.BotCommand(command="id", description="ADMIN: Get user info"),
-            types.BotCommand(command="warn", description="ADMIN: Warn a user"),
-            types.BotCommand(command="block", description="ADMIN: Temporarily block a user"),
-            types.BotCommand(command="pblock", description="ADMIN: Permanently block a user"),
-            types.BotCommand(command="unblock", description="ADMIN: Unblock a user"),
-        ]
-        await bot.set_my_commands(commands)
-        await bot.set_my_commands(admin_commands, scope=types.BotCommandScopeChat(chat_id=ADMIN_ID))
+        await bot.set_my_commands(BOT_COMMANDS)
+        await bot.set_my_commands(ADMIN_BOT_COMMANDS, scope=types.BotCommandScopeChat(chat_id=ADMIN_ID))
 
         # --- Webhook Configuration ---
-        # Get webhook URL from Render environment
-        webhook_host = os.getenv("RENDER_EXTERNAL_HOSTNAME", "")
+        # Get webhook host from WEBHOOK_HOST, falling back to the Render environment
+        webhook_host = os.getenv("WEBHOOK_HOST") or os.getenv("RENDER_EXTERNAL_HOSTNAME", "")
         if webhook_host:
-            # Use webhook mode on Render
+            # Use webhook mode whenever a public host is known
             WEBHOOK_PATH = f"/webhook/{BOT_TOKEN}"
             webhook_url = f"https://{webhook_host}{WEBHOOK_PATH}"
             
@@ -1688,12 +2044,13 @@ async def main():
             await site.start()
             logging.info(f"Bot started with webhook on port {port}")
             
-            # Keep running
-            while True:
-                await asyncio.sleep(3600)
+            # Keep running until cancelled
+            await asyncio.Event().wait()
         else:
             # Fallback to polling (for local development)
             logging.info("Starting with polling...")
+            # Polling has no web app of its own; answer the platform's health checks from a separate thread
+            start_health_server_thread()
             await dp.start_polling(bot, skip_updates=True)
 
     except Exception as e:
@@ -1704,6 +2061,7 @@ async def main():
             await bot.delete_webhook(drop_pending_updates=True)
         if bot and bot.session:
             await bot.session.close()
+        await dp.storage.close()
         if db:
             await db.close()
         logging.info("Bot stopped.")